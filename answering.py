@@ -0,0 +1,95 @@
+"""Question -> SQL -> rows, shared by the Telegram handler and batch_answer.py"""
+from database import db
+from sql_rewriter import USE_ROLLUPS, rewrite_sql
+from video_replica import replica
+
+
+class NoSQLGenerated(Exception):
+    """Neither the model nor the fallback produced a SELECT statement"""
+
+
+def _rewrite(sql):
+    # A database started without a load may not have the rollup tables yet
+    return rewrite_sql(sql, use_rollups=USE_ROLLUPS and db.rollups_ready)
+
+
+async def _fetch(sql, trace):
+    """Answer from the in-memory videos replica when it covers the SQL, else PostgreSQL"""
+    if replica.ready:
+        with trace.stage('replica'):
+            rows = replica.execute(sql)
+        if rows is not None:
+            return rows
+    return await db.fetch_guarded(_rewrite(sql), trace=trace, generated_sql=sql)
+
+
+async def _first_valid(sqls):
+    """Index of the best-ranked candidate that would run, or None"""
+    # Candidates the replica answers are valid without planning
+    covered = next((i for i, sql in enumerate(sqls) if replica.covers(sql)), len(sqls))
+    if covered == 0:
+        return 0
+    index = await db.first_valid([_rewrite(sql) for sql in sqls[:covered]])
+    if index is None and covered < len(sqls):
+        return covered
+    return index
+
+
+async def _run_candidates(question, sqls, trace):
+    """(index, rows) of the best-ranked candidate that runs.
+
+    All candidates are validated first, in parallel; a failing top
+    candidate then costs that one EXPLAIN round trip instead of a whole
+    guarded run, and the plan of the one that runs is already cached.
+    """
+    first = 0
+    if len(sqls) > 1:
+        with trace.stage('validate'):
+            first = await _first_valid(sqls)
+        # With nothing valid, run the last resort so its error is reported
+        first = len(sqls) - 1 if first is None else first
+    error = None
+    for index in range(first, len(sqls)):
+        try:
+            return index, await _fetch(sqls[index], trace)
+        except Exception as e:
+            # Planned fine but failed at run time, e.g. on the statement timeout
+            print(f"SQL error: {e}\nSQL: {sqls[index]}\nQuery: {question}")
+            error = e
+    raise error
+
+
+async def answer_question(generator, batcher, question: str, trace, chat_id=None):
+    """Generate SQL for question and run it; returns (sql, rows).
+
+    The generator ranks several candidates (n-best model beams, then the
+    rule-based fallback). They are validated together, each with EXPLAIN on
+    its own pool connection, and the best-ranked one that plans within the
+    cost budget runs: a failing top candidate costs one parallel step
+    instead of a failed run followed by the fallback. A cached shape whose
+    SQL failed is discarded, and model SQL that executed is cached.
+    trace.sql and trace.outcome describe the SQL that produced the rows.
+    chat_id groups requests for the batcher's per-chat fairness; under load
+    it may raise sql_batcher.Overloaded.
+    """
+    candidates = await batcher.generate_candidates(question, trace, chat_id)
+    candidates = [(sql.strip(), outcome) for sql, outcome in candidates
+                  if sql.strip().upper().startswith("SELECT")]
+    if not candidates:
+        trace.outcome = 'error'
+        raise NoSQLGenerated(trace.sql)
+
+    try:
+        index, rows = await _run_candidates(question, [sql for sql, _ in candidates], trace)
+    except Exception:
+        trace.outcome = 'error'
+        if candidates[0][1] not in ('rules', 'fallback'):
+            generator.discard(question)
+        raise
+    if index > 0 and candidates[0][1] not in ('rules', 'fallback'):
+        generator.discard(question)
+    sql, outcome = candidates[index]
+    trace.sql, trace.outcome = sql, outcome
+    if outcome == 'model':
+        generator.remember(question, sql)
+    return sql, rows
@@ -0,0 +1,151 @@
+"""Answer a file of questions offline.
+
+    python batch_answer.py questions.jsonl --output answers.jsonl
+    python batch_answer.py questions.txt --output answers.jsonl --resume
+
+Input is JSONL with a "question" field (and optionally an "id") per line,
+or plain text with one question per line; ids default to the line number.
+Questions go through the same path as the bot (rules, caches, batched
+model inference, guarded execution over the pool, fallback), with at most
+--concurrency of them in flight. Each answer is appended to the output as
+a JSONL record as soon as it is ready, so with --resume an interrupted run
+skips the ids already in the output and continues.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+from answering import answer_question
+from database import db
+from metrics import Trace
+from sql_batcher import SQLBatcher
+from sql_generator import SQLGenerator
+from video_replica import replica
+
+
+def read_questions(path):
+    """Yield (id, question) for every non-empty input line"""
+    jsonl = path.endswith('.jsonl')
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not jsonl:
+                yield str(number), line
+                continue
+            item = json.loads(line)
+            yield str(item.get('id', number)), item['question']
+
+
+def completed_ids(path):
+    """Ids already answered in an earlier run's output.
+
+    A record cut off by an interruption is truncated away, so appending
+    continues on a line boundary.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    done = set()
+    for line in data[:end].splitlines():
+        try:
+            done.add(str(json.loads(line)['id']))
+        except (ValueError, KeyError):
+            continue
+    return done
+
+
+def _rows(rows):
+    return [dict(row) for row in rows]
+
+
+async def answer_one(generator, batcher, item_id, question):
+    trace = Trace(question)
+    record = {'id': item_id, 'question': question}
+    try:
+        _, rows = await answer_question(generator, batcher, question, trace)
+        record['rows'] = _rows(rows)
+    except Exception as e:
+        trace.outcome = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        trace.finish()
+    record['sql'] = trace.sql
+    record['outcome'] = trace.outcome
+    record['total_ms'] = round((time.perf_counter() - trace.started) * 1000, 2)
+    record['stages_ms'] = {s: round(v * 1000, 2) for s, v in trace.stages.items()}
+    return record
+
+
+async def run(args):
+    done = completed_ids(args.output) if args.resume else set()
+    generator = SQLGenerator()
+    # Every question has to be answered, so nothing is shed
+    batcher = SQLBatcher(generator, max_batch_size=args.batch_size, max_wait_ms=args.batch_wait_ms,
+                         max_queue=0, max_chat_queue=0, wait_budget_ms=0, deadline_ms=0)
+    await db.connect()
+    batcher.start()
+    if replica.enabled:
+        await replica.refresh()
+
+    outcomes = Counter()
+    in_flight = set()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    started = time.perf_counter()
+    skipped = 0
+
+    with open(args.output, 'a' if args.resume else 'w', encoding='utf-8') as out:
+        async def worker(item_id, question):
+            try:
+                record = await answer_one(generator, batcher, item_id, question)
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+                out.flush()
+                outcomes[record['outcome']] += 1
+            finally:
+                semaphore.release()
+
+        try:
+            for item_id, question in read_questions(args.input):
+                if item_id in done:
+                    skipped += 1
+                    continue
+                await semaphore.acquire()
+                task = asyncio.create_task(worker(item_id, question))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            if in_flight:
+                await asyncio.gather(*in_flight)
+        finally:
+            await batcher.close()
+            generator.save_caches()
+            await db.close()
+
+    elapsed = time.perf_counter() - started
+    answered = sum(outcomes.values())
+    print(f"Answered {answered} questions in {elapsed:.1f}s "
+          f"({answered / elapsed if elapsed else 0:.1f}/s), skipped {skipped} already answered")
+    print("By outcome: " + ", ".join(f"{k}={v}" for k, v in sorted(outcomes.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer questions from a JSONL or text file")
+    parser.add_argument("input", help="questions: .jsonl with a question field, or one per line")
+    parser.add_argument("--output", default="answers.jsonl")
+    parser.add_argument("--resume", action="store_true", help="skip ids already in --output and append")
+    parser.add_argument("--concurrency", type=int, default=64, help="questions in flight at once")
+    # Throughput over latency: bigger batches, and a longer wait to fill them
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batch-wait-ms", type=float, default=50)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compare serial try-fail-fallback with parallel validation of SQL candidates.
+
+    python -m benchmarks.candidates --runs 50
+
+Uses the data already loaded in the configured database. Each case is a
+ranked candidate list whose top SQL fails the way model output does (an
+unknown column, broken syntax, a plan over the cost budget), followed by a
+second beam and the rule-based fallback. "serial" runs the top candidate,
+and after it fails the fallback, one after the other, as the bot used to;
+"parallel" is answering._run_candidates: all candidates are validated at
+once with Database.first_valid, then the best valid one runs. Neither path
+uses the in-memory replica. With --cold the plan cost cache is cleared
+before every call, as for SQL the model has not produced before.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks import report
+from benchmarks.questions import CREATOR_ID
+from answering import _run_candidates
+from database import db
+from metrics import Trace
+from sql_rewriter import rewrite_sql
+
+FALLBACK = f"SELECT COUNT(*) FROM videos WHERE creator_id = '{CREATOR_ID}'"
+CASES = {
+    "unknown_column": [
+        f"SELECT COUNT(*) FROM videos WHERE creator = '{CREATOR_ID}'",
+        f"SELECT COUNT(id) FROM videos WHERE creator_id = '{CREATOR_ID}'",
+        FALLBACK,
+    ],
+    "syntax_error": [
+        f"SELECT COUNT(*) FROM videos WHERE creator_id = '{CREATOR_ID}' AND",
+        f"SELECT COUNT(id) FROM videos WHERE creator_id = '{CREATOR_ID}'",
+        FALLBACK,
+    ],
+    "over_budget": [
+        "SELECT COUNT(*) FROM video_snapshots a, video_snapshots b WHERE a.views_count > b.views_count",
+        f"SELECT COUNT(id) FROM videos WHERE creator_id = '{CREATOR_ID}'",
+        FALLBACK,
+    ],
+    "valid_top": [
+        f"SELECT COUNT(id) FROM videos WHERE creator_id = '{CREATOR_ID}'",
+        f"SELECT COUNT(*) FROM videos WHERE creator = '{CREATOR_ID}'",
+        FALLBACK,
+    ],
+}
+
+
+def _ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+async def serial(candidates):
+    top, fallback = candidates[0], candidates[-1]
+    try:
+        return await db.fetch_guarded(rewrite_sql(top))
+    except Exception:
+        return await db.fetch_guarded(rewrite_sql(fallback))
+
+
+async def parallel(candidates):
+    return await _run_candidates(None, candidates, Trace())
+
+
+async def run(args):
+    await db.connect()
+    results = {}
+    try:
+        for name, candidates in CASES.items():
+            timings = {"serial": [], "parallel": []}
+            for _ in range(args.runs):
+                for mode, func in (("serial", serial), ("parallel", parallel)):
+                    if args.cold:
+                        db._plans.clear()
+                    started = time.perf_counter()
+                    await func(candidates)
+                    timings[mode].append(_ms(started))
+            results[name] = {mode: report.summarize(t) for mode, t in timings.items()}
+    finally:
+        await db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--cold", action="store_true", help="clear the plan cost cache before every call")
+    parser.add_argument("--output", help="also write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        report.save({"run": report.run_info(), "args": vars(args), "cases": results}, args.output)
+    for name, timings in results.items():
+        print(f"{name}: serial {timings['serial']['p50_ms']:.2f} ms, "
+              f"parallel {timings['parallel']['p50_ms']:.2f} ms (p50)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compare decoding with and without the statement-end stop and schema constraint.
+
+    python -m benchmarks.constrained_decoding --runs 3
+
+Runs the model directly on every corpus question (no rules or caches) and
+reports latency, generated tokens per question and how often _clean_sql
+had to give up (the share of questions that would go to the fallback).
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from benchmarks import report
+from benchmarks.questions import CORPUS
+from sql_generator import SQLGenerator
+
+CONFIGS = {
+    "unconstrained": {"stop_at_statement_end": False, "schema_constrained": False},
+    "stop_only": {"stop_at_statement_end": True, "schema_constrained": False},
+    "stop_and_schema": {"stop_at_statement_end": True, "schema_constrained": True},
+}
+
+
+def evaluate(generator, name, settings, runs):
+    for key, value in settings.items():
+        setattr(generator, key, value)
+    pad_id = generator.tokenizer.pad_token_id
+    timings, tokens, fallbacks = [], [], 0
+    for question in CORPUS:
+        for _ in range(runs):
+            torch.manual_seed(0)
+            started = time.perf_counter()
+            inputs = generator._encode_batch([question])
+            prompt_length = 0 if generator.model.config.is_encoder_decoder else inputs["input_ids"].shape[1]
+            with torch.inference_mode():
+                outputs = generator.model.generate(**inputs, **generator._generation_kwargs(prompt_length))
+            generated = outputs[0, prompt_length:]
+            raw = generator.tokenizer.decode(generated, skip_special_tokens=True)
+            sql = generator._clean_sql(raw.strip())
+            timings.append((time.perf_counter() - started) * 1000)
+        tokens.append(int((generated != pad_id).sum()))
+        fallbacks += sql is None
+    return {
+        "config": name,
+        **report.summarize(timings),
+        "mean_generated_tokens": sum(tokens) / len(tokens),
+        "fallback_rate": fallbacks / len(CORPUS),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    generator = SQLGenerator()
+    if generator.model is None:
+        raise SystemExit("Model not found in ./model, nothing to benchmark")
+    results = [evaluate(generator, name, settings, args.runs) for name, settings in CONFIGS.items()]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
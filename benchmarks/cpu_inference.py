@@ -0,0 +1,73 @@
+"""Compare the original decode settings with the CPU serving mode.
+
+    python -m benchmarks.cpu_inference --runs 3
+
+Latency is per question (batch of one) through the model only, bypassing
+rules and caches. Accuracy is exact agreement with the rule engine's SQL on
+the questions it answers confidently, which serves as the reference.
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from benchmarks import report
+from benchmarks.questions import QUESTIONS
+from intents import match_intent
+from sql_generator import SQLGenerator
+
+CONFIGS = {
+    "baseline": {"inference_mode": "default", "decoding": "sample", "quantize": False},
+    "cpu": {"inference_mode": "cpu", "decoding": "greedy", "quantize": True},
+}
+
+
+def _normalize(sql):
+    return " ".join(sql.split()).rstrip(";").lower() if sql else None
+
+
+def evaluate(name, settings, runs):
+    generator = SQLGenerator(**settings)
+    if generator.model is None:
+        raise SystemExit("Model not found in ./model, nothing to benchmark")
+    generator._generate_with_model(QUESTIONS[:1])  # warm-up
+
+    timings, outputs = [], []
+    for question in QUESTIONS:
+        for _ in range(runs):
+            torch.manual_seed(0)
+            started = time.perf_counter()
+            sql = generator._generate_with_model([question])[0]
+            timings.append((time.perf_counter() - started) * 1000)
+        outputs.append(sql)
+
+    references = [(out, match_intent(q)) for q, out in zip(QUESTIONS, outputs)]
+    scored = [(out, ref) for out, ref in references if ref]
+    return {
+        "config": name,
+        **settings,
+        # Same summary as benchmarks.run, so CPU and GPU reports compare
+        **report.summarize(timings),
+        "valid_sql_rate": sum(out is not None for out in outputs) / len(outputs),
+        "exact_match": sum(_normalize(out) == _normalize(ref) for out, ref in scored) / max(len(scored), 1),
+        "outputs": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = [evaluate(name, settings, args.runs) for name, settings in CONFIGS.items()]
+    baseline, cpu = results
+    agreement = sum(
+        _normalize(a) == _normalize(b) for a, b in zip(baseline["outputs"], cpu["outputs"])
+    ) / len(QUESTIONS)
+    print(json.dumps({"results": results, "output_agreement": agreement}, indent=2, ensure_ascii=False))
+    print(f"Speedup: {baseline['mean_ms'] / cpu['mean_ms']:.2f}x, output agreement {agreement:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Generate a synthetic videos.json in the format load_data.py reads.
+
+    python -m benchmarks.generate_data --videos 20000 --snapshots 50 --output videos.synthetic.json
+
+Each video gets an hourly snapshot series starting at publication. Views
+grow at a rate that decays after publication, scaled by a log-normal
+popularity, and likes, comments and reports follow the views; deltas are
+the differences between consecutive snapshots, and the video's counters
+are those of its last snapshot. The file is written one video at a time,
+so millions of snapshots need no more memory than one video.
+"""
+import argparse
+import json
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks.questions import CREATOR_ID, VIDEO_ID
+
+METRICS = ("views_count", "likes_count", "comments_count", "reports_count")
+
+
+def _timestamp(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _uuid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def make_video(rng, video_id, creator_id, published, snapshots, interval):
+    popularity = rng.lognormvariate(0, 1.5)
+    like_rate = rng.uniform(0.02, 0.08)
+    comment_rate = rng.uniform(0.002, 0.01)
+    report_rate = rng.uniform(0, 0.0005)
+
+    totals = dict.fromkeys(METRICS, 0)
+    series = []
+    for i in range(snapshots):
+        taken = published + interval * (i + 1)
+        # Views per interval fall off over the first day or so
+        views = int(popularity * 500 * math.exp(-i * interval.total_seconds() / 86400) * rng.uniform(0.5, 1.5))
+        deltas = {
+            "views_count": views,
+            "likes_count": int(views * like_rate * rng.uniform(0.5, 1.5)),
+            "comments_count": int(views * comment_rate * rng.uniform(0.5, 1.5)),
+            "reports_count": int(rng.random() < views * report_rate),
+        }
+        snapshot = {}
+        for metric in METRICS:
+            totals[metric] += deltas[metric]
+            snapshot[metric] = totals[metric]
+            snapshot[f"delta_{metric}"] = deltas[metric]
+        snapshot["created_at"] = snapshot["updated_at"] = _timestamp(taken)
+        series.append(snapshot)
+
+    return {
+        "id": str(video_id),
+        "creator_id": creator_id,
+        "video_created_at": _timestamp(published),
+        **totals,
+        "created_at": _timestamp(published),
+        "updated_at": series[-1]["created_at"] if series else _timestamp(published),
+        "snapshots": series,
+    }
+
+
+def iter_videos(videos, snapshots, start, days, interval_hours=1, videos_per_creator=20, seed=0):
+    rng = random.Random(seed)
+    creators = [CREATOR_ID] + [_uuid(rng).hex for _ in range(max(videos // videos_per_creator, 1) - 1)]
+    interval = timedelta(hours=interval_hours)
+    window = days * 86400
+    for i in range(videos):
+        # The first video is the one the benchmark questions ask about
+        video_id = VIDEO_ID if i == 0 else _uuid(rng)
+        creator_id = CREATOR_ID if i == 0 else rng.choice(creators)
+        published = start + timedelta(seconds=rng.randrange(window))
+        yield make_video(rng, video_id, creator_id, published, snapshots, interval)
+
+
+def write_videos(path, videos, **kwargs):
+    """Stream a top-level JSON array to path; returns (videos, snapshots) written"""
+    written = snapshots = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for video in iter_videos(videos, **kwargs):
+            if written:
+                f.write(",\n")
+            f.write(json.dumps(video, ensure_ascii=False))
+            written += 1
+            snapshots += len(video["snapshots"])
+        f.write("\n]\n")
+    return written, snapshots
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--videos", type=int, default=10000)
+    parser.add_argument("--snapshots", type=int, default=48, help="snapshots per video")
+    parser.add_argument("--interval-hours", type=float, default=1)
+    parser.add_argument("--start", default="2025-11-01", help="first publication day")
+    parser.add_argument("--days", type=int, default=28, help="publication window")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="videos.synthetic.json")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    videos, snapshots = write_videos(
+        args.output, args.videos, snapshots=args.snapshots, start=datetime.fromisoformat(args.start),
+        days=args.days, interval_hours=args.interval_hours, seed=args.seed,
+    )
+    print(f"Wrote {videos} videos and {snapshots} snapshots to {args.output} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Compare date-filtered snapshot queries on a plain and a month-partitioned video_snapshots.
+
+    python -m benchmarks.partitioning --videos 20000 --snapshots 120 --runs 5
+
+Generates a synthetic dataset spread over several months, loads it once per
+layout with load_json_to_db (this recreates the tables in the configured
+database) and times the same queries against each. Queries go through
+make_sargable but not the rollups, so they read video_snapshots itself.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import report
+from benchmarks.generate_data import write_videos
+from benchmarks.questions import CREATOR_ID
+from database import db
+from load_data import load_json_to_db
+from sql_rewriter import make_sargable
+
+QUERIES = {
+    "day_sum": "SELECT COALESCE(SUM(delta_views_count), 0) FROM video_snapshots "
+               "WHERE DATE(created_at) = '2025-11-28'",
+    "day_distinct_videos": "SELECT COUNT(DISTINCT video_id) FROM video_snapshots "
+                           "WHERE DATE(created_at) = '2025-11-28' AND delta_likes_count > 0",
+    "week_sum": "SELECT COALESCE(SUM(delta_likes_count), 0) FROM video_snapshots "
+                "WHERE DATE(created_at) BETWEEN '2025-11-22' AND '2025-11-28'",
+    "month_count": "SELECT COUNT(*) FROM video_snapshots "
+                   "WHERE DATE(created_at) BETWEEN '2025-11-01' AND '2025-11-30'",
+    "creator_day": "SELECT COALESCE(SUM(delta_views_count), 0) FROM video_snapshots "
+                   "WHERE DATE(created_at) = '2025-11-28' AND video_id IN "
+                   f"(SELECT id FROM videos WHERE creator_id = '{CREATOR_ID}')",
+}
+
+
+async def measure(path, partitioned, runs):
+    started = time.perf_counter()
+    await load_json_to_db(path, partitioned=partitioned)
+    load_seconds = time.perf_counter() - started
+
+    results = {"load_seconds": load_seconds, "queries": {}}
+    async with db.acquire() as conn:
+        results["snapshots_mb"] = await conn.fetchval("""
+            SELECT (SUM(pg_total_relation_size(oid)) / 1048576.0)::float8 FROM pg_class
+            WHERE oid = 'video_snapshots'::regclass
+               OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'video_snapshots'::regclass)
+        """)
+        for name, sql in QUERIES.items():
+            sql = make_sargable(sql)
+            await conn.fetchval(sql)  # warm-up
+            timings = []
+            for _ in range(runs):
+                query_started = time.perf_counter()
+                await conn.fetchval(sql)
+                timings.append((time.perf_counter() - query_started) * 1000)
+            plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}"))[0]["Plan"]
+            results["queries"][name] = {**report.summarize(timings), "relations": sorted(_relations(plan))}
+    return results
+
+
+def _relations(plan):
+    names = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for child in plan.get("Plans", ()):
+        names |= _relations(child)
+    return names
+
+
+async def run(args):
+    path = args.data
+    if path is None:
+        handle = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        handle.close()
+        path = handle.name
+        # Snapshots every interval over about five months
+        write_videos(path, args.videos, snapshots=args.snapshots, start=datetime(2025, 7, 1),
+                     days=150, interval_hours=args.interval_hours, seed=args.seed)
+    await db.connect()
+    try:
+        layouts = {}
+        for name, partitioned in (("plain", False), ("partitioned", True)):
+            print(f"Loading {name} layout...")
+            layouts[name] = await measure(path, partitioned, args.runs)
+    finally:
+        await db.close()
+        if args.data is None:
+            os.unlink(path)
+    return layouts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", help="existing videos.json instead of generated data")
+    parser.add_argument("--videos", type=int, default=20000)
+    parser.add_argument("--snapshots", type=int, default=120, help="snapshots per video")
+    parser.add_argument("--interval-hours", type=float, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="also write results as JSON to this path")
+    args = parser.parse_args()
+
+    layouts = asyncio.run(run(args))
+    results = {"run": report.run_info(), "args": vars(args), "layouts": layouts}
+    if args.output:
+        report.save(results, args.output)
+    for name in QUERIES:
+        plain = layouts["plain"]["queries"][name]["p50_ms"]
+        partitioned = layouts["partitioned"]["queries"][name]["p50_ms"]
+        print(f"{name}: {plain:.2f} ms -> {partitioned:.2f} ms ({plain / partitioned:.1f}x), "
+              f"scans {', '.join(layouts['partitioned']['queries'][name]['relations'])}")
+    for name, layout in layouts.items():
+        print(f"{name}: load {layout['load_seconds']:.1f}s, video_snapshots {layout['snapshots_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
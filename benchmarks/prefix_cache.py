@@ -0,0 +1,54 @@
+"""Compare model generation latency with and without schema prefix reuse on CPU.
+
+    python -m benchmarks.prefix_cache --runs 20 --batch-size 1
+"""
+import argparse
+import json
+import statistics
+import time
+
+import torch
+
+from benchmarks.questions import QUESTIONS
+from sql_generator import SQLGenerator
+
+
+def measure(generator, reuse, runs, batch_size):
+    generator.reuse_schema_prefix = reuse
+    batch = (QUESTIONS * batch_size)[:batch_size]
+    # The corpus questions all match rules; call the model directly so every
+    # run generates, bypassing the rules and both caches
+    torch.manual_seed(0)
+    generator._generate_candidates(batch)  # warm-up
+    timings = []
+    for _ in range(runs):
+        torch.manual_seed(0)
+        started = time.perf_counter()
+        generator._generate_candidates(batch)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "reuse_schema_prefix": reuse,
+        "batch_size": batch_size,
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "min_ms": min(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+
+    generator = SQLGenerator()
+    if generator.model is None:
+        raise SystemExit("Model not found in ./model, nothing to benchmark")
+    results = [measure(generator, reuse, args.runs, args.batch_size) for reuse in (False, True)]
+    print(json.dumps(results, indent=2))
+    baseline, reused = results
+    print(f"Speedup: {baseline['mean_ms'] / reused['mean_ms']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Russian benchmark questions.
+
+The ids and dates refer to rows that benchmarks.generate_data always
+includes, so the questions return non-empty results on synthetic data.
+"""
+
+CREATOR_ID = "aca1061a9d324ecf8c3fa2bb32d7be63"
+VIDEO_ID = "ecd8a4e4-1f24-4b97-a944-35d17078ce7c"
+
+QUESTIONS = [
+    "Сколько всего видео есть в системе?",
+    f"Сколько видео у креатора с id {CREATOR_ID}?",
+    "Сколько видео набрало больше 100000 просмотров?",
+    f"Сколько лайков у видео {VIDEO_ID}?",
+    "На сколько просмотров в сумме выросли все видео 28 ноября 2025?",
+    "Сколько разных видео получали новые просмотры 27 ноября 2025?",
+    f"Сколько всего просмотров у креатора с id {CREATOR_ID}?",
+    "Сколько видео опубликовано с 1 по 5 ноября 2025?",
+]
+
+# Questions the rule engine once answered with the wrong SQL: open date
+# ranges, negation, relative dates, metrics and words no intent has a place
+# for. match_intent must leave every one of them to the model.
+RULE_MISREADS = [
+    "Сколько видео опубликовано после 1 ноября 2025?",
+    "Сколько видео опубликовано до 1 ноября 2025?",
+    "Сколько видео не получили ни одного лайка?",
+    "Сколько видео без просмотров?",
+    "Сколько видео получили жалобы?",
+    "Сколько видео загружено вчера?",
+    "Сколько снимков сделано за 28 ноября 2025?",
+    "Сколько видео не набрало больше 1000 просмотров?",
+]
+
+# Every shape _fallback_sql and the rule engine know, then questions only
+# the model can answer
+CORPUS = QUESTIONS + [
+    # video_metric
+    f"Сколько просмотров у видео {VIDEO_ID}?",
+    f"Сколько комментариев у видео {VIDEO_ID}?",
+    f"Сколько жалоб у видео {VIDEO_ID}?",
+    # video_count with filters
+    "Сколько видео набрало не менее 5000 лайков?",
+    "Сколько видео получили меньше 10 комментариев?",
+    f"Сколько видео у креатора с id {CREATOR_ID} набрали больше 1000 просмотров?",
+    "Сколько видео опубликовано 3 ноября 2025?",
+    "Сколько видео вышло в ноябре 2025?",
+    f"Сколько видео креатора с id {CREATOR_ID} опубликовано с 1 по 10 ноября 2025?",
+    # metric_total
+    "Сколько всего лайков у всех видео?",
+    "Сколько всего комментариев набрали видео?",
+    f"Сколько всего жалоб у креатора с id {CREATOR_ID}?",
+    # metric_growth
+    "На сколько выросли лайки 28 ноября 2025?",
+    "Какой общий прирост комментариев с 25 по 28 ноября 2025?",
+    f"На сколько выросли просмотры видео креатора с id {CREATOR_ID} 27 ноября 2025?",
+    "Какой прирост просмотров за ноябрь 2025?",
+    # videos_with_new_metric
+    "Сколько разных видео получали новые лайки 28 ноября 2025?",
+    "Сколько видео получили новые комментарии с 26 по 28 ноября 2025?",
+    f"Сколько разных видео креатора с id {CREATOR_ID} получали новые просмотры 28 ноября 2025?",
+    # Beyond the rules
+    "Какое среднее количество просмотров у видео?",
+    "Какое максимальное количество лайков у одного видео?",
+    "Сколько креаторов опубликовали хотя бы одно видео?",
+    "Какие 5 видео набрали больше всего просмотров?",
+    "Сколько просмотров набирали видео по дням с 25 по 28 ноября 2025?",
+    "Какой процент видео получил хотя бы одну жалобу?",
+    *RULE_MISREADS,
+]
@@ -0,0 +1,84 @@
+"""Compare videos aggregates answered by the in-memory replica and by PostgreSQL.
+
+    python -m benchmarks.replica --runs 200
+
+Uses the data already loaded in the configured database. Every query is
+the rule-based SQL of a corpus question (plus a few filter combinations)
+that the replica covers; each is run through VideoReplica.execute and
+through Database.fetch_guarded after rewrite_sql, the results are checked
+to be equal and both are timed.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks import report
+from benchmarks.questions import CORPUS, CREATOR_ID, VIDEO_ID
+from database import db
+from intents import match_intent
+from sql_rewriter import rewrite_sql
+from video_replica import VideoReplica, parse
+
+EXTRA_QUERIES = (
+    "SELECT COUNT(*) FROM videos WHERE views_count > 100000",
+    "SELECT COALESCE(SUM(views_count), 0) FROM videos WHERE views_count >= 5000",
+    "SELECT SUM(likes_count) FROM videos WHERE views_count < 1000",
+    f"SELECT COUNT(*) FROM videos WHERE creator_id = '{CREATOR_ID}' AND likes_count > 100",
+    f"SELECT likes_count FROM videos WHERE id = '{VIDEO_ID}'",
+    "SELECT COUNT(*) FROM videos WHERE DATE(video_created_at) BETWEEN '2025-11-01' AND '2025-11-05' "
+    "AND views_count <> 0",
+)
+
+
+def _ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+async def run(args):
+    queries = list(dict.fromkeys(
+        [match_intent(q, strict=False) or "SELECT COUNT(*) FROM videos" for q in CORPUS] + list(EXTRA_QUERIES)
+    ))
+    queries = [sql for sql in queries if parse(sql) is not None]
+    replica = VideoReplica(enabled=True)
+    await db.connect()
+    try:
+        started = time.perf_counter()
+        await replica.refresh()
+        results = {"refresh_ms": _ms(started), "videos": replica.stats()["size"], "queries": {}}
+        for sql in queries:
+            expected = [tuple(row.values()) for row in await db.fetch_guarded(rewrite_sql(sql))]
+            got = [tuple(row.values()) for row in replica.execute(sql)]
+            if got != expected:
+                raise AssertionError(f"{sql}: replica {got} != postgres {expected}")
+            timings = {"replica": [], "postgres": []}
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                replica.execute(sql)
+                timings["replica"].append(_ms(started))
+                started = time.perf_counter()
+                await db.fetch_guarded(rewrite_sql(sql))
+                timings["postgres"].append(_ms(started))
+            results["queries"][sql] = {name: report.summarize(t) for name, t in timings.items()}
+    finally:
+        await db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--output", help="also write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        report.save({"run": report.run_info(), "args": vars(args), **results}, args.output)
+    print(f"Replica of {results['videos']} videos built in {results['refresh_ms']:.0f} ms")
+    for sql, timings in results["queries"].items():
+        replica_us = timings["replica"]["p50_ms"] * 1000
+        postgres_ms = timings["postgres"]["p50_ms"]
+        print(f"{replica_us:8.1f} us vs {postgres_ms:7.2f} ms  {sql}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Shared helpers for summarizing and saving benchmark results"""
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+
+def summarize(timings_ms):
+    """Latency summary of a list of timings in milliseconds"""
+    timings = sorted(timings_ms)
+    if not timings:
+        return {"count": 0}
+    return {
+        "count": len(timings),
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "p95_ms": timings[math.ceil(len(timings) * 0.95) - 1],
+        "max_ms": timings[-1],
+    }
+
+
+def _git(*args):
+    try:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_info():
+    """Where and on what code the benchmark ran"""
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save(results, path=None):
+    """Write results as JSON, by default to benchmark-results/<commit>.json"""
+    if path is None:
+        commit = (results.get("run") or {}).get("commit") or "unknown"
+        path = os.path.join("benchmark-results", f"{commit[:12]}.json")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    return path
@@ -0,0 +1,204 @@
+"""End-to-end benchmarks against a local PostgreSQL.
+
+    python -m benchmarks.run --suites load,generate,postprocess,query --videos 20000
+
+Suites:
+  load         load_json_to_db throughput on a synthetic videos.json
+               (recreates the tables in the configured database, so it
+               only runs when named in --suites)
+  generate     generate_sql latency per path: rules, model, fallback
+               (first checks that the rules leave RULE_MISREADS to the model)
+  postprocess  _clean_sql and rewrite_sql cost per call
+  query        Database.execute_value latency of the fallback SQL for
+               every corpus question, as generated and after rewrite_sql
+
+Results are written as JSON tagged with the commit, by default to
+benchmark-results/<commit>.json, so runs can be diffed across commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import report
+from benchmarks.generate_data import write_videos
+from benchmarks.questions import CORPUS, RULE_MISREADS
+from database import db
+
+SUITES = ("load", "generate", "postprocess", "query")
+# Run when --suites is not given; "load" drops the tables and is never implied
+DEFAULT_SUITES = ("generate", "postprocess", "query")
+
+
+def _ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+async def bench_load(args):
+    from load_data import load_json_to_db
+
+    path = args.data
+    generated = None
+    if path is None:
+        generated = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        generated.close()
+        path = generated.name
+        write_videos(path, args.videos, snapshots=args.snapshots,
+                     start=datetime(2025, 11, 1), days=28, seed=args.seed)
+    try:
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        totals = await load_json_to_db(path)
+        elapsed = time.perf_counter() - started
+    finally:
+        if generated is not None:
+            os.unlink(path)
+    rows = totals["videos"] + totals["snapshots"]
+    return {
+        **totals,
+        "file_mb": size / 2**20,
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed,
+    }
+
+
+def _generator():
+    from sql_generator import SQLGenerator
+
+    generator = SQLGenerator()
+    # Every call should reach the path being measured
+    generator.cache.max_size = 0
+    generator.cache._templates.clear()
+    return generator
+
+
+def bench_generate(args, generator):
+    from intents import match_intent
+
+    misread = [q for q in RULE_MISREADS if match_intent(q)]
+    if misread:
+        raise AssertionError(f"rules answered questions they cannot express: {misread}")
+
+    paths = {
+        "rules": lambda q: match_intent(q),
+        "fallback": generator._fallback_sql,
+    }
+    if generator.model is not None:
+        generator._generate_with_model(CORPUS[:1])  # warm-up
+        paths["model"] = lambda q: generator._generate_with_model([q])[0]
+
+    results = {}
+    for name, func in paths.items():
+        timings, answered = [], 0
+        for question in CORPUS:
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                sql = func(question)
+                timings.append(_ms(started))
+            answered += sql is not None
+        results[name] = {**report.summarize(timings), "answered": answered / len(CORPUS)}
+    if generator.model is None:
+        results["model"] = None
+    return results
+
+
+def bench_postprocess(args, generator):
+    from sql_rewriter import rewrite_sql
+
+    sqls = [generator._fallback_sql(q) for q in CORPUS]
+    # Shaped like raw decoder output
+    raw = [f"SQL: {sql};\n-- trailing text" for sql in sqls]
+    iterations = args.runs * 100
+
+    results = {}
+    for name, func, inputs in (
+        ("clean_sql", generator._clean_sql, raw),
+        ("rewrite_sql", rewrite_sql, sqls),
+    ):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for value in inputs:
+                func(value)
+        calls = iterations * len(inputs)
+        results[name] = {"calls": calls, "mean_us": _ms(started) * 1000 / calls}
+    return results
+
+
+async def bench_query(args, generator):
+    from sql_rewriter import rewrite_sql
+
+    results = {"generated": [], "rewritten": []}
+    totals = {"generated": [], "rewritten": []}
+    for question in CORPUS:
+        sql = generator._fallback_sql(question)
+        for variant, query in (("generated", sql), ("rewritten", rewrite_sql(sql))):
+            await db.execute_value(query)  # warm-up
+            timings = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                await db.execute_value(query)
+                timings.append(_ms(started))
+            totals[variant].extend(timings)
+            results[variant].append({"question": question, "sql": query, **report.summarize(timings)})
+    return {
+        variant: {"overall": report.summarize(totals[variant]), "queries": results[variant]}
+        for variant in results
+    }
+
+
+async def run(args):
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        raise SystemExit(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    results = {"run": report.run_info(), "args": vars(args), "suites": {}}
+    needs_db = {"load", "query"} & set(suites)
+    if needs_db:
+        await db.connect()
+    generator = _generator() if {"generate", "postprocess", "query"} & set(suites) else None
+    try:
+        for suite in SUITES:
+            if suite not in suites:
+                continue
+            print(f"Running {suite}...")
+            if suite == "load":
+                results["suites"]["load"] = await bench_load(args)
+            elif suite == "generate":
+                results["suites"]["generate"] = bench_generate(args, generator)
+            elif suite == "postprocess":
+                results["suites"]["postprocess"] = bench_postprocess(args, generator)
+            else:
+                results["suites"]["query"] = await bench_query(args, generator)
+    finally:
+        if needs_db:
+            await db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suites", default=",".join(DEFAULT_SUITES),
+                        help="comma-separated; add load explicitly, it recreates the tables")
+    parser.add_argument("--data", help="existing videos.json for the load suite")
+    parser.add_argument("--videos", type=int, default=10000, help="synthetic videos to generate")
+    parser.add_argument("--snapshots", type=int, default=48, help="snapshots per synthetic video")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="results path (default benchmark-results/<commit>.json)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    path = report.save(results, args.output)
+    for suite, result in results["suites"].items():
+        if suite == "query":
+            result = {variant: r["overall"] for variant, r in result.items()}
+        print(f"{suite}: {json.dumps(result, ensure_ascii=False)}")
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,32 @@ import os
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
-from database import db
+from database import db, QUERY_MAX_ROWS
+from answering import NoSQLGenerated, answer_question
 from sql_generator import SQLGenerator
+from sql_batcher import Overloaded, SQLBatcher
+from metrics import Trace, register_pool, register_scheduler, start_server
+from video_replica import replica
 
 load_dotenv()
 
 bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
 dp = Dispatcher()
-sql_generator = SQLGenerator()
+# The model loads in the background from main(); until then the rules answer
+sql_generator = SQLGenerator(load=False)
+sql_batcher = SQLBatcher(sql_generator)
+
+
+def format_answer(rows) -> str:
+    """A single value as is, several rows as lines of columns"""
+    if not rows:
+        return "0"
+    if len(rows) == 1 and len(rows[0]) == 1:
+        return str(rows[0][0] if rows[0][0] is not None else 0)
+    lines = [" | ".join(str(value) for value in row.values()) for row in rows]
+    if len(rows) >= QUERY_MAX_ROWS:
+        lines.append("...")
+    return "\n".join(lines)
 
 
 @dp.message(Command("start"))
@@ -26,34 +44,39 @@ async def start(message: types.Message):
 
 @dp.message()
 async def handle_message(message: types.Message):
+    trace = Trace(message.text)
     try:
-        sql = sql_generator.generate_sql(message.text).strip()
-        if not sql.upper().startswith("SELECT"):
-            await message.answer("Could not generate SQL. Please rephrase.")
-            return
-        
-        # Try to execute SQL, if error - use fallback
-        try:
-            result = await db.execute_value(sql) or 0
-            await message.answer(str(result))
-        except Exception as db_error:
-            print(f"SQL error: {db_error}\nSQL: {sql}\nQuery: {message.text}")
-            # Try fallback
-            fallback_sql = sql_generator._fallback_sql(message.text)
-            if fallback_sql != sql:
-                result = await db.execute_value(fallback_sql) or 0
-                await message.answer(str(result))
-            else:
-                await message.answer("Error. Please try again.")
+        _, rows = await answer_question(sql_generator, sql_batcher, message.text, trace, message.chat.id)
+        await message.answer(format_answer(rows))
+    except NoSQLGenerated:
+        await message.answer("Could not generate SQL. Please rephrase.")
+    except Overloaded:
+        await message.answer("Too many questions right now. Please try again in a minute.")
     except Exception as e:
+        trace.outcome = 'error'
         print(f"Error: {e}\nQuery: {message.text}")
         await message.answer("Error. Please try again.")
+    finally:
+        trace.finish()
 
 
 async def main():
     await db.connect()
+    sql_generator.load_in_background()
+    sql_batcher.start()
+    replica.start()
+    register_pool(db.pool_stats)
+    register_scheduler(sql_batcher.stats)
+    metrics_runner = await start_server()
     print("Bot started...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await sql_batcher.close()
+        await replica.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        sql_generator.save_caches()
 
 
 if __name__ == "__main__":
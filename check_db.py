@@ -12,7 +12,7 @@ async def check_connection():
         print("Database connection successful")
         
         # Проверяем наличие таблиц
-        async with db.pool.acquire() as conn:
+        async with db.acquire() as conn:
             tables = await conn.fetch("""
                 SELECT table_name 
                 FROM information_schema.tables 
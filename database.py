@@ -1,37 +1,422 @@
+import asyncio
 import asyncpg
+import json
 import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Secondary indexes, kept separate from the DDL so bulk loads can drop them
+# while copying and rebuild them once at the end.
+INDEXES = {
+    'idx_videos_creator_id': 'videos(creator_id)',
+    'idx_videos_created_at': 'videos(video_created_at)',
+    'idx_snapshots_video_id': 'video_snapshots(video_id)',
+    'idx_snapshots_created_at': 'video_snapshots(created_at)',
+}
+# Partitions already narrow a query to its months; within a month snapshots
+# are appended roughly in time order, which a BRIN index on created_at
+# exploits at a fraction of a B-tree's size
+PARTITIONED_INDEXES = {
+    **INDEXES,
+    'idx_snapshots_created_at': 'video_snapshots USING brin (created_at)',
+}
+# Store video_snapshots as monthly range partitions on created_at
+SNAPSHOTS_PARTITIONED = os.getenv('SNAPSHOTS_PARTITIONED', 'false').lower() == 'true'
+
+# Budget for generated SQL: server-side timeout and EXPLAIN cost ceiling
+QUERY_TIMEOUT_MS = int(os.getenv('QUERY_TIMEOUT_MS', 5000))
+QUERY_MAX_COST = float(os.getenv('QUERY_MAX_COST', 1000000))
+# Most rows a guarded fetch returns to the caller
+QUERY_MAX_ROWS = int(os.getenv('QUERY_MAX_ROWS', 50))
+
+# Pool sizing and timeouts (seconds). DB_COMMAND_TIMEOUT=0 leaves bulk loads
+# and index builds unbounded; generated SQL has its own statement_timeout.
+POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))
+POOL_MAX_QUERIES = int(os.getenv('DB_POOL_MAX_QUERIES', 50000))
+ACQUIRE_TIMEOUT = float(os.getenv('DB_ACQUIRE_TIMEOUT', 10))
+CONNECT_TIMEOUT = float(os.getenv('DB_CONNECT_TIMEOUT', 10))
+COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', 0)) or None
+# asyncpg keeps an LRU of prepared statements per connection, keyed by SQL text
+STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 256))
+STATEMENT_CACHE_LIFETIME = float(os.getenv('DB_STATEMENT_CACHE_LIFETIME', 600))
+# EXPLAIN cost estimates kept for repeated generated SQL
+PLAN_COST_CACHE_SIZE = int(os.getenv('DB_PLAN_COST_CACHE_SIZE', 1024))
+# JSONL log of every executed generated statement with its latency and plan,
+# read by index_advisor.py; unset disables it
+QUERY_LOG_PATH = os.getenv('QUERY_LOG_PATH')
+
+
+PARTITION_BOUND_RE = re.compile(r"TO \('(\d{4}-\d{2}-\d{2})")
+
+
+class QueryRejected(Exception):
+    """A generated query was refused before it ran"""
+
+
+def plan_nodes(plan) -> list:
+    """Scan nodes of an EXPLAIN (FORMAT JSON) plan, e.g. 'Index Scan using idx on videos'"""
+    nodes = []
+    if 'Relation Name' in plan or 'Index Name' in plan:
+        node = plan['Node Type']
+        if 'Index Name' in plan:
+            node += f" using {plan['Index Name']}"
+        if 'Relation Name' in plan:
+            node += f" on {plan['Relation Name']}"
+        nodes.append(node)
+    for child in plan.get('Plans', ()):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+class _QueryLog:
+    """Appends entries to QUERY_LOG_PATH on a writer thread, off the event loop"""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def write(self, entry):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='query-log', daemon=True)
+            self._thread.start()
+        self._queue.put({'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'), **entry})
+
+    def flush(self):
+        """Block until the entries written so far are in the file"""
+        if self._thread is not None:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+
+    def _run(self):
+        while True:
+            # Everything queued meanwhile goes out with one open and write
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = [json.dumps(item, ensure_ascii=False) + '\n' for item in items if isinstance(item, dict)]
+            if lines:
+                try:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.writelines(lines)
+                except OSError as e:
+                    print(f"Could not write query log {self.path}: {e}")
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+
+_query_log = _QueryLog(QUERY_LOG_PATH) if QUERY_LOG_PATH else None
+
 
 class Database:
     def __init__(self):
         self.pool = None
+        self._connect_lock = asyncio.Lock()
+        # query -> (total cost, scan nodes) of its EXPLAIN plan
+        self._plans = OrderedDict()
+        self._waiting = 0
+        self._acquired = 0
+        self._acquire_timeouts = 0
+        self._acquire_wait = 0.0
+        self._plan_cost_hits = 0
+        self._plan_cost_misses = 0
+        self._partitions = None
+        # Whether the daily rollups exist and are built, so sql_rewriter may route to them
+        self.rollups_ready = False
+        # Plans still running after first_valid returned; they fill the plan cost cache
+        self._validations = set()
 
-    async def connect(self):
-        self.pool = await asyncpg.create_pool(
-            host=os.getenv('DB_HOST', 'localhost'),
-            port=int(os.getenv('DB_PORT', 5432)),
-            user=os.getenv('POSTGRES_USER', 'postgres'),
-            password=os.getenv('POSTGRES_PASSWORD'),
-            database=os.getenv('POSTGRES_DB', 'tg_bot')
+    async def connect(self) -> bool:
+        """Create the pool unless it already exists; True if this call created it"""
+        async with self._connect_lock:
+            if self.pool is not None:
+                return False
+            self.pool = await asyncpg.create_pool(
+                host=os.getenv('DB_HOST', 'localhost'),
+                port=int(os.getenv('DB_PORT', 5432)),
+                user=os.getenv('POSTGRES_USER', 'postgres'),
+                password=os.getenv('POSTGRES_PASSWORD'),
+                database=os.getenv('POSTGRES_DB', 'tg_bot'),
+                min_size=POOL_MIN_SIZE,
+                max_size=max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+                max_queries=POOL_MAX_QUERIES,
+                max_inactive_connection_lifetime=POOL_MAX_IDLE,
+                timeout=CONNECT_TIMEOUT,
+                command_timeout=COMMAND_TIMEOUT,
+                statement_cache_size=STATEMENT_CACHE_SIZE,
+                max_cached_statement_lifetime=STATEMENT_CACHE_LIFETIME,
+            )
+            async with self.acquire() as conn:
+                self.rollups_ready = await self._rollups_built(conn)
+            return True
+
+    @staticmethod
+    async def _rollups_built(conn) -> bool:
+        """Both rollup tables exist and are filled, unless there are no snapshots to roll up"""
+        if await conn.fetchval(
+            "SELECT to_regclass('daily_video_stats') IS NULL OR to_regclass('daily_snapshot_stats') IS NULL"
+        ):
+            return False
+        return await conn.fetchval(
+            "SELECT EXISTS (SELECT 1 FROM daily_snapshot_stats) OR NOT EXISTS (SELECT 1 FROM video_snapshots)"
         )
 
     async def close(self):
         if self.pool:
-            await self.pool.close()
+            pool, self.pool = self.pool, None
+            await pool.close()
+        if _query_log is not None:
+            await asyncio.to_thread(_query_log.flush)
+
+    @asynccontextmanager
+    async def acquire(self, trace=None):
+        """Pool connection with wait time tracked for pool_stats (and trace as db_acquire)"""
+        started = time.perf_counter()
+        self._waiting += 1
+        try:
+            conn = await self.pool.acquire(timeout=ACQUIRE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._acquire_timeouts += 1
+            raise
+        finally:
+            self._waiting -= 1
+        waited = time.perf_counter() - started
+        self._acquired += 1
+        self._acquire_wait += waited
+        if trace is not None:
+            trace.add('db_acquire', waited)
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    def pool_stats(self) -> dict:
+        """Pool saturation: open/idle/busy connections, waiters and acquire wait"""
+        stats = {
+            'size': 0, 'idle': 0, 'in_use': 0,
+            'min_size': POOL_MIN_SIZE, 'max_size': max(POOL_MAX_SIZE, POOL_MIN_SIZE),
+            'waiting': self._waiting,
+            'acquired': self._acquired,
+            'acquire_timeouts': self._acquire_timeouts,
+            'mean_acquire_wait_ms': self._acquire_wait * 1000 / self._acquired if self._acquired else 0.0,
+            'plan_cost_cache': {
+                'size': len(self._plans),
+                'hits': self._plan_cost_hits,
+                'misses': self._plan_cost_misses,
+            },
+        }
+        if self.pool is not None:
+            stats['size'] = self.pool.get_size()
+            stats['idle'] = self.pool.get_idle_size()
+            stats['in_use'] = stats['size'] - stats['idle']
+        return stats
 
     async def execute_value(self, query: str, *args):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             return await conn.fetchval(query, *args)
 
-    async def create_tables(self):
-        async with self.pool.acquire() as conn:
-            await conn.execute("DROP TABLE IF EXISTS video_snapshots CASCADE")
-            await conn.execute("DROP TABLE IF EXISTS videos CASCADE")
+    async def fetch(self, query: str, *args):
+        """All result rows in one round trip"""
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args):
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args)
+
+    @asynccontextmanager
+    async def iterate(self, query: str, *args, prefetch: int = None):
+        """Stream rows through a server-side cursor, prefetch rows per round trip.
+
+            async with db.iterate(query) as rows:
+                async for row in rows:
+                    ...
+
+        The connection goes back to the pool when the block exits, also when
+        the loop is left early, not when a generator is garbage-collected.
+        """
+        async with self.acquire() as conn:
+            # Cursors only live inside a transaction
+            async with conn.transaction(readonly=True):
+                yield conn.cursor(query, *args, prefetch=prefetch)
+
+    async def execute_guarded(self, query: str, *args, timeout_ms: int = None, max_cost: float = None,
+                              trace=None, generated_sql: str = None):
+        """Run generated SQL read-only, under a statement_timeout and a plan cost budget.
+
+        The EXPLAIN estimate is checked first and a query over budget is
+        rejected with QueryRejected without running; the bot's SQL is almost
+        all aggregates, whose cost no LIMIT lowers. Returns the first column
+        of the first row. Cancelling the awaiting task cancels the statement
+        on the server. Pool wait and execution are recorded on trace as
+        db_acquire and db_execute. With QUERY_LOG_PATH every statement that
+        ran or was rejected over budget is logged with its plan cost and scan
+        nodes (and latency, if it ran) for index_advisor.py; generated_sql,
+        the SQL before sql_rewriter, is logged next to it.
+        """
+        rows = await self._run_guarded(query, args, 1, timeout_ms, max_cost, trace, generated_sql)
+        return rows[0][0] if rows else None
+
+    async def fetch_guarded(self, query: str, *args, max_rows: int = None, timeout_ms: int = None,
+                            max_cost: float = None, trace=None, generated_sql: str = None):
+        """Like execute_guarded, but return up to max_rows rows of the result"""
+        return await self._run_guarded(query, args, max_rows or QUERY_MAX_ROWS, timeout_ms, max_cost, trace,
+                                       generated_sql)
+
+    async def _run_guarded(self, query, args, max_rows, timeout_ms, max_cost, trace, generated_sql=None):
+        timeout_ms = timeout_ms or QUERY_TIMEOUT_MS
+        max_cost = max_cost or QUERY_MAX_COST
+        query = query.strip().rstrip(';').strip()
+        if ';' in query:
+            raise QueryRejected("Multiple statements are not allowed")
+
+        async with self.acquire(trace) as conn:
+            started = time.perf_counter()
+            entry = executed = None
+            try:
+                async with self._guarded(conn, timeout_ms):
+                    cost, nodes = await self._cached_plan(conn, query, *args)
+                    entry = {'sql': query, 'cost': cost, 'plan': nodes}
+                    if generated_sql and generated_sql.strip() != query:
+                        entry['generated_sql'] = generated_sql.strip()
+                    if cost > max_cost:
+                        entry['error'] = 'over_budget'
+                        raise QueryRejected(f"Estimated cost {cost:.0f} exceeds budget {max_cost:.0f}")
+                    executed = time.perf_counter()
+                    # The cursor pulls at most max_rows rows in one round trip
+                    rows = []
+                    async for record in conn.cursor(query, *args, prefetch=max_rows):
+                        rows.append(record)
+                        if len(rows) >= max_rows:
+                            break
+                    entry['rows'] = len(rows)
+                    return rows
+            except asyncpg.QueryCanceledError:
+                if entry is not None:
+                    entry['error'] = 'timeout'
+                raise
+            except asyncpg.PostgresError as e:
+                if entry is not None:
+                    entry['error'] = type(e).__name__
+                raise
+            finally:
+                if trace is not None:
+                    trace.add('db_execute', time.perf_counter() - started)
+                if entry is not None and _query_log is not None:
+                    if executed is not None:
+                        entry['ms'] = round((time.perf_counter() - executed) * 1000, 2)
+                    _query_log.write(entry)
+
+    @staticmethod
+    @asynccontextmanager
+    async def _guarded(conn, timeout_ms):
+        """Read-only transaction under statement_timeout, where generated SQL runs and is planned"""
+        async with conn.transaction(readonly=True):
+            await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+            yield
+
+    async def first_valid(self, queries, max_cost: float = None, timeout_ms: int = None):
+        """Index of the first query that plans within the cost budget, or None.
+
+        Every query is planned with EXPLAIN on its own pool connection at
+        once, and the answer is returned as soon as all queries ranked above
+        it are known to fail; a query that does not parse, names unknown
+        tables or columns, or is over budget fails. A query whose plan cost
+        is cached within budget passes without a connection, and queries
+        ranked below it are not checked. Checks of lower-ranked queries are
+        left to finish in the background and fill the plan cost cache.
+        EXPLAIN runs in the same read-only transaction and statement_timeout
+        as execute_guarded; a check that cannot get a connection or loses it
+        fails that query only.
+        """
+        timeout_ms = timeout_ms or QUERY_TIMEOUT_MS
+        max_cost = max_cost or QUERY_MAX_COST
+        queries = [query.strip().rstrip(';').strip() for query in queries]
+        # A cached plan within budget needs no connection, nor do the queries below it
+        cached = next((i for i, query in enumerate(queries)
+                       if query in self._plans and self._plans[query][0] <= max_cost), len(queries))
+
+        async def check(query):
+            if ';' in query:
+                return False
+            try:
+                async with self.acquire() as conn, self._guarded(conn, timeout_ms):
+                    cost, _ = await self._cached_plan(conn, query)
+                return cost <= max_cost
+            except (asyncpg.PostgresError, asyncpg.InterfaceError, asyncio.TimeoutError, OSError):
+                return False
+
+        checks = [asyncio.create_task(check(query)) for query in queries[:cached]]
+        for task in checks:
+            self._validations.add(task)
+            task.add_done_callback(self._validation_done)
+        for index, task in enumerate(checks):
+            if await task:
+                return index
+        return cached if cached < len(queries) else None
+
+    def _validation_done(self, task):
+        self._validations.discard(task)
+        if not task.cancelled():
+            # Retrieve errors of checks nobody awaited, so they are not reported as lost
+            task.exception()
+
+    async def _cached_plan(self, conn, query: str, *args) -> tuple:
+        # Only plain SQL is cached; with parameters the plan may depend on values
+        if args:
+            return await self._plan(conn, query, *args)
+        plan = self._plans.get(query)
+        if plan is not None:
+            self._plans.move_to_end(query)
+            self._plan_cost_hits += 1
+            return plan
+        self._plan_cost_misses += 1
+        plan = await self._plan(conn, query)
+        self._plans[query] = plan
+        while len(self._plans) > PLAN_COST_CACHE_SIZE:
+            self._plans.popitem(last=False)
+        return plan
+
+    @staticmethod
+    async def _plan(conn, query: str, *args) -> tuple:
+        """(total cost, scan nodes) of query's estimated plan"""
+        plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args))[0]['Plan']
+        return plan['Total Cost'], plan_nodes(plan)
+
+    async def create_tables(self, drop: bool = True, partitioned: bool = None):
+        """Create the schema; with drop=False existing tables and data are kept.
+
+        partitioned (SNAPSHOTS_PARTITIONED by default) creates video_snapshots
+        partitioned by month of created_at; partitions are added by
+        ensure_partitions as data for new months arrives. An existing table
+        keeps its layout.
+        """
+        if partitioned is None:
+            partitioned = SNAPSHOTS_PARTITIONED
+        self._partitions = None
+        async with self.acquire() as conn:
+            if drop:
+                await conn.execute("DROP TABLE IF EXISTS daily_snapshot_stats")
+                await conn.execute("DROP TABLE IF EXISTS daily_video_stats")
+                await conn.execute("DROP TABLE IF EXISTS video_snapshots CASCADE")
+                await conn.execute("DROP TABLE IF EXISTS videos CASCADE")
             await conn.execute("""
-                CREATE TABLE videos (
+                CREATE TABLE IF NOT EXISTS videos (
                     id VARCHAR(255) PRIMARY KEY,
                     creator_id VARCHAR(255) NOT NULL,
                     video_created_at TIMESTAMP NOT NULL,
@@ -43,9 +428,12 @@ class Database:
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """)
-            await conn.execute("""
-                CREATE TABLE video_snapshots (
-                    id BIGSERIAL PRIMARY KEY,
+            # A partitioned table's primary key has to include the partition key
+            primary_key = "PRIMARY KEY (id, created_at)" if partitioned else "PRIMARY KEY (id)"
+            partition_by = "PARTITION BY RANGE (created_at)" if partitioned else ""
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS video_snapshots (
+                    id BIGSERIAL,
                     video_id VARCHAR(255) NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
                     views_count INTEGER NOT NULL DEFAULT 0,
                     likes_count INTEGER NOT NULL DEFAULT 0,
@@ -56,14 +444,161 @@ class Database:
                     delta_comments_count INTEGER NOT NULL DEFAULT 0,
                     delta_reports_count INTEGER NOT NULL DEFAULT 0,
                     created_at TIMESTAMP NOT NULL,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    {primary_key}
+                ) {partition_by}
+            """)
+            # Per-video-per-day and per-day rollups of video_snapshots. The max_
+            # columns answer "videos with a snapshot where delta > N" exactly.
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS daily_video_stats (
+                    day DATE NOT NULL,
+                    video_id VARCHAR(255) NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+                    snapshots_count INTEGER NOT NULL,
+                    delta_views_count BIGINT NOT NULL,
+                    delta_likes_count BIGINT NOT NULL,
+                    delta_comments_count BIGINT NOT NULL,
+                    delta_reports_count BIGINT NOT NULL,
+                    max_delta_views_count INTEGER NOT NULL,
+                    max_delta_likes_count INTEGER NOT NULL,
+                    max_delta_comments_count INTEGER NOT NULL,
+                    max_delta_reports_count INTEGER NOT NULL,
+                    PRIMARY KEY (day, video_id)
                 )
             """)
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_creator_id ON videos(creator_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_videos_created_at ON videos(video_created_at)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_video_id ON video_snapshots(video_id)")
-            await conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_created_at ON video_snapshots(created_at)")
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS daily_snapshot_stats (
+                    day DATE PRIMARY KEY,
+                    snapshots_count BIGINT NOT NULL,
+                    videos_count INTEGER NOT NULL,
+                    delta_views_count BIGINT NOT NULL,
+                    delta_likes_count BIGINT NOT NULL,
+                    delta_comments_count BIGINT NOT NULL,
+                    delta_reports_count BIGINT NOT NULL
+                )
+            """)
+            self.rollups_ready = await self._rollups_built(conn)
+        await self.create_indexes()
         print("Tables created")
 
+    async def refresh_rollups(self, conn=None, days=None):
+        """Rebuild the daily rollups, for all days or only the given dates"""
+        # Plan costs were estimated on the old data
+        self._plans.clear()
+        if conn is None:
+            async with self.acquire() as conn:
+                async with conn.transaction():
+                    return await self.refresh_rollups(conn, days)
+
+        if days is None:
+            await conn.execute("TRUNCATE daily_video_stats, daily_snapshot_stats")
+            snapshots_filter, rollup_filter, args = "", "", ()
+        else:
+            days = sorted(days)
+            await conn.execute("DELETE FROM daily_video_stats WHERE day = ANY($1::date[])", days)
+            await conn.execute("DELETE FROM daily_snapshot_stats WHERE day = ANY($1::date[])", days)
+            # Sargable on created_at, then narrowed to the exact days
+            snapshots_filter = ("WHERE created_at >= $1::date AND created_at < $2::date + 1 "
+                                "AND created_at::date = ANY($3::date[])")
+            rollup_filter = "WHERE day = ANY($1::date[])"
+            args = (days[0], days[-1], days)
+
+        await conn.execute(f"""
+            INSERT INTO daily_video_stats
+            SELECT created_at::date, video_id, COUNT(*),
+                   SUM(delta_views_count), SUM(delta_likes_count),
+                   SUM(delta_comments_count), SUM(delta_reports_count),
+                   MAX(delta_views_count), MAX(delta_likes_count),
+                   MAX(delta_comments_count), MAX(delta_reports_count)
+            FROM video_snapshots {snapshots_filter}
+            GROUP BY 1, 2
+        """, *args)
+        await conn.execute(f"""
+            INSERT INTO daily_snapshot_stats
+            SELECT day, SUM(snapshots_count), COUNT(*),
+                   SUM(delta_views_count), SUM(delta_likes_count),
+                   SUM(delta_comments_count), SUM(delta_reports_count)
+            FROM daily_video_stats {rollup_filter}
+            GROUP BY day
+        """, *args[2:])
+        self.rollups_ready = True
+
+    async def has_videos(self) -> bool:
+        """Whether the videos table exists and holds at least one row"""
+        async with self.acquire() as conn:
+            if await conn.fetchval("SELECT to_regclass('videos')") is None:
+                return False
+            return await conn.fetchval("SELECT EXISTS (SELECT 1 FROM videos)")
+
+    async def snapshots_partitioned(self, conn=None) -> bool:
+        if conn is None:
+            async with self.acquire() as conn:
+                return await self.snapshots_partitioned(conn)
+        return await conn.fetchval(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('video_snapshots')"
+        ) or False
+
+    async def ensure_partitions(self, months, conn=None):
+        """Create the monthly video_snapshots partitions for months (dates) that lack one"""
+        if conn is None:
+            async with self.acquire() as conn:
+                return await self.ensure_partitions(months, conn)
+        # Partitions created in a transaction may still be rolled back, so
+        # inside one the catalog is read every time instead of the cache
+        in_transaction = conn.is_in_transaction()
+        known = self._partitions
+        if known is None or in_transaction:
+            known = set(await conn.fetchval(
+                "SELECT COALESCE(array_agg(inhrelid::regclass::text), '{}') FROM pg_inherits "
+                "WHERE inhparent = 'video_snapshots'::regclass"
+            ))
+            if not in_transaction:
+                self._partitions = known
+        for month in sorted({date(m.year, m.month, 1) for m in months}):
+            name = f"video_snapshots_{month:%Y_%m}"
+            if name in known:
+                continue
+            upper = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+            await conn.execute(
+                f"CREATE TABLE {name} PARTITION OF video_snapshots "
+                f"FOR VALUES FROM ('{month}') TO ('{upper}')"
+            )
+            known.add(name)
+
+    async def detach_partitions(self, before) -> list:
+        """Detach monthly partitions that end on or before the date before.
+
+        The detached tables keep their rows and names and can be archived or
+        dropped; a month whose table is still there cannot be loaded again.
+        """
+        async with self.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+                FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'video_snapshots'::regclass
+            """)
+            detached = []
+            for row in rows:
+                upper = PARTITION_BOUND_RE.search(row['bound'])
+                if upper and date.fromisoformat(upper.group(1)) <= before:
+                    await conn.execute(f"ALTER TABLE video_snapshots DETACH PARTITION {row['relname']}")
+                    detached.append(row['relname'])
+        self._partitions = None
+        return detached
+
+    async def create_indexes(self):
+        """Build the secondary indexes in parallel, one pool connection each"""
+        async def build(name, target):
+            async with self.acquire() as conn:
+                await conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+        indexes = PARTITIONED_INDEXES if await self.snapshots_partitioned() else INDEXES
+        await asyncio.gather(*(build(name, target) for name, target in indexes.items()))
+
+    async def drop_indexes(self):
+        async with self.acquire() as conn:
+            for name in INDEXES:
+                await conn.execute(f"DROP INDEX IF EXISTS {name}")
+
 
 db = Database()
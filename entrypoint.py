@@ -1,19 +1,23 @@
 #!/usr/bin/env python3
 """Entrypoint script that loads data and starts the bot"""
 import asyncio
+import importlib
 import sys
 import os
+import time
 import asyncpg
 from database import db
-from load_data import load_json_to_db
+from load_data import load_json_to_db, sync_json_to_db
 
 
-async def wait_for_postgres():
-    """Wait for PostgreSQL to be ready"""
-    max_retries = 30
-    retry_count = 0
-    
-    while retry_count < max_retries:
+async def wait_for_postgres(timeout: float = 30):
+    """Wait for PostgreSQL to be ready, polling with a short backoff"""
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    attempt = 0
+
+    while True:
+        attempt += 1
         try:
             conn = await asyncpg.connect(
                 host=os.getenv('DB_HOST', 'postgres'),
@@ -26,19 +30,17 @@ async def wait_for_postgres():
             print("PostgreSQL is ready!")
             return True
         except Exception:
-            retry_count += 1
-            if retry_count < max_retries:
-                print(f"Waiting for PostgreSQL... ({retry_count}/{max_retries})")
-                await asyncio.sleep(1)
-            else:
-                print("Failed to connect to PostgreSQL after 30 retries")
+            if time.monotonic() + delay > deadline:
+                print(f"Failed to connect to PostgreSQL after {attempt} attempts")
                 return False
-    
-    return False
+            if attempt % 5 == 1:
+                print(f"Waiting for PostgreSQL... (attempt {attempt})")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1)
 
 
 async def check_and_load_data():
-    """Check if database needs data loading"""
+    """Bring the database in line with videos.json"""
     auto_load = os.getenv('AUTO_LOAD_DATA', 'true').lower() == 'true'
     
     if not auto_load:
@@ -51,23 +53,17 @@ async def check_and_load_data():
         return
     
     try:
-        await db.connect()
-        try:
-            # Try to check if tables exist and have data
-            count = await db.execute_value('SELECT COUNT(*) FROM videos')
-            await db.close()
-            if count == 0:
-                print('Database is empty, loading data from videos.json...')
-                await load_json_to_db(json_file)
-                print('Data loaded successfully!')
-            else:
-                print(f'Database already has {count} videos, skipping data load.')
-        except Exception as e:
-            # Tables don't exist or error checking
-            await db.close()
-            print('Tables not found or error checking, loading data will create them...')
+        if not await db.has_videos():
+            # First start: the bulk COPY loader, nothing to keep serving yet
+            print('Database is empty, loading videos.json...')
             await load_json_to_db(json_file)
             print('Data loaded successfully!')
+            return
+        # Incremental sync: applies only new or changed rows in one
+        # transaction while the bot keeps serving
+        print('Syncing database with videos.json...')
+        await sync_json_to_db(json_file)
+        print('Data synced successfully!')
     except Exception as e:
         print(f"Error during data loading: {e}")
         import traceback
@@ -75,22 +71,51 @@ async def check_and_load_data():
         print("Warning: Continuing bot startup despite data loading error...")
 
 
+async def timed(phase: str, coro):
+    """Await coro and log how long the phase took"""
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        print(f"[startup] {phase} took {time.perf_counter() - started:.2f}s")
+
+
 async def main():
-    """Main entrypoint"""
+    """Main entrypoint.
+
+    The model loads on a background thread while PostgreSQL comes up and the
+    data is synced; polling starts as soon as the database is reachable and
+    answers from the rule-based path until the model is ready.
+    """
     print("Starting initialization...")
-    
-    # Wait for PostgreSQL
-    if not await wait_for_postgres():
+    started = time.perf_counter()
+
+    # aiogram takes seconds to import, so the bot module is imported on a
+    # thread while we wait for PostgreSQL, and the model load starts as soon
+    # as the import finishes, without waiting for the database
+    async def import_bot():
+        bot = await timed("bot import", asyncio.to_thread(importlib.import_module, "bot"))
+        bot.sql_generator.load_in_background()
+        return bot
+
+    bot_import = asyncio.create_task(import_bot())
+    postgres_ready = await timed("waiting for PostgreSQL", wait_for_postgres())
+    bot = await bot_import
+
+    if not postgres_ready:
         print("Error: Could not connect to PostgreSQL. Exiting.")
         sys.exit(1)
-    
-    # Load data if needed
-    await check_and_load_data()
-    
-    # Start bot by importing and running bot.py
-    print("Starting bot...")
-    import bot
-    await bot.main()
+    # Shared by the bot and the data sync, so neither closes it under the other
+    await db.connect()
+
+    # The sync runs in one transaction, so the bot can serve during it
+    data_task = asyncio.create_task(timed("data sync", check_and_load_data()))
+
+    print(f"Starting bot... ({time.perf_counter() - started:.2f}s after start)")
+    try:
+        await bot.main()
+    finally:
+        data_task.cancel()
 
 
 if __name__ == "__main__":
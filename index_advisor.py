@@ -0,0 +1,524 @@
+"""Propose indexes for the slow query shapes in the query log.
+
+    python index_advisor.py query_log.jsonl
+    python index_advisor.py query_log.jsonl --min-count 5 --min-ms 100 --create
+
+Reads the JSONL log that Database.fetch_guarded and execute_guarded write
+with QUERY_LOG_PATH. Statements are grouped into shapes (the SQL with its
+literals replaced by ?); shapes seen at least --min-count times whose
+median latency is at least --min-ms, or that hit the statement timeout or
+were rejected over the cost budget, are ranked, rejected ones first, then
+by total time. The predicates of each shape's statement and subqueries are
+parsed and one index per filtered table is proposed:
+
+- equality columns first, then one range column, as a composite index;
+- a filter on an expression such as EXTRACT(DAY FROM video_created_at)
+  indexes the expression;
+- a condition with the same literal in every statement of the shape, such
+  as delta_views_count > 0, becomes the WHERE of a partial index.
+
+The log holds the SQL that ran, after sql_rewriter: DATE(col) compared with
+a date literal has already become a range on col there, so it gets a column
+index, not an expression one. The model's SQL is kept as generated_sql.
+
+Proposals an existing B-tree index already covers are skipped. The others
+are estimated with EXPLAIN before and after adding the index, hypothetical
+with the hypopg extension. Without hypopg they are only listed, unless
+--build-real-indexes builds each one inside a transaction that is rolled
+back: the build blocks writes to the table while it runs, so it gives up
+after waiting BUILD_LOCK_TIMEOUT_MS for the lock or running
+--build-timeout-ms. With --create, proposals that lower the estimated cost by at
+least --min-gain are built with CREATE INDEX CONCURRENTLY (plain CREATE
+INDEX on a partitioned table, which does not support it).
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import statistics
+from collections import defaultdict
+
+import asyncpg
+
+from database import QUERY_LOG_PATH, db, plan_nodes
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+LIST_RE = re.compile(r'\?(?:\s*,\s*\?)+')
+SELECT_RE = re.compile(r'\s*SELECT\b', re.IGNORECASE)
+FROM_RE = re.compile(r'\bFROM\b', re.IGNORECASE)
+WHERE_RE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+CLAUSE_END_RE = re.compile(
+    r'\b(?:GROUP\s+BY|ORDER\s+BY|HAVING|LIMIT|OFFSET|WINDOW|UNION|INTERSECT|EXCEPT|FETCH|FOR)\b', re.IGNORECASE
+)
+JOIN_RE = re.compile(r',|\b(?:(?:LEFT|RIGHT|FULL|INNER|CROSS)\s+(?:OUTER\s+)?)?JOIN\b', re.IGNORECASE)
+ON_RE = re.compile(r'\bON\b', re.IGNORECASE)
+TABLE_RE = re.compile(r'^(?:ONLY\s+)?(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?$', re.IGNORECASE)
+CONNECTIVE_RE = re.compile(r'\b(BETWEEN|AND|OR)\b', re.IGNORECASE)
+OPERATOR_RE = re.compile(
+    r'\s+(NOT\s+BETWEEN|BETWEEN|NOT\s+IN|IN|IS\s+NOT\s+NULL|IS\s+NULL|NOT\s+I?LIKE|I?LIKE)\b'
+    r'|\s*(<>|!=|>=|<=|=|>|<)\s*',
+    re.IGNORECASE,
+)
+REF_RE = re.compile(r'\b(?:(\w+)\.)?([A-Za-z_]\w*)\b(?!\s*\()')
+COLUMN_RE = re.compile(r'^(?:(\w+)\.)?(\w+)$')
+# Not allowed in an index expression or predicate, which must be immutable
+VOLATILE_RE = re.compile(r'\b(?:now|random|current_\w+|localtime\w*|clock_timestamp)\b|\bSELECT\b', re.IGNORECASE)
+
+KINDS = {
+    '=': 'eq', 'in': 'eq', '<>': 'ne', '!=': 'ne', 'not in': 'ne',
+    '>': 'range', '>=': 'range', '<': 'range', '<=': 'range', 'between': 'range', 'not between': 'ne',
+    'is null': 'null', 'is not null': 'null',
+}
+# Monthly partitions of video_snapshots and their indexes, see Database.ensure_partitions
+PARTITION_RE = re.compile(r'_\d{4}_\d{2}(?=_|\b)')
+FLIPPED = {'>': '<', '>=': '<=', '<': '>', '<=': '>='}
+# Longest wait for the table lock of an index built to be estimated
+BUILD_LOCK_TIMEOUT_MS = 1000
+
+
+def read_log(path):
+    """Yield log entries that ran to completion, hit the statement timeout or were over budget"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get('error') == 'over_budget' or ('ms' in entry and entry.get('error') in (None, 'timeout')):
+                yield entry
+
+
+def shape(sql: str) -> str:
+    """sql with literals replaced by ?, the key statements are grouped by"""
+    return LIST_RE.sub('?', LITERAL_RE.sub('?', ' '.join(sql.split()))).lower()
+
+
+def group_log(entries):
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(shape(entry['sql']),
+                                  {'count': 0, 'ms': [], 'timeouts': 0, 'rejected': 0, 'statements': {}})
+        group['count'] += 1
+        # Statements rejected over budget never ran and have no latency
+        if 'ms' in entry:
+            group['ms'].append(entry['ms'])
+        group['timeouts'] += entry.get('error') == 'timeout'
+        group['rejected'] += entry.get('error') == 'over_budget'
+        group['statements'][entry['sql']] = group['statements'].get(entry['sql'], 0) + 1
+    for key, group in groups.items():
+        group['shape'] = key
+        group['median_ms'] = statistics.median(group['ms']) if group['ms'] else 0.0
+        group['total_ms'] = sum(group['ms'])
+        # Most frequent statement first; it is the one estimated
+        group['statements'] = sorted(group['statements'], key=group['statements'].get, reverse=True)
+    return list(groups.values())
+
+
+def _mask(sql):
+    """sql with quoted text and the inside of parentheses blanked, positions kept"""
+    chars, depth, quoted = [], 0, False
+    for ch in sql:
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted and ch == '(':
+            depth += 1
+            if depth == 1:
+                chars.append(ch)
+                continue
+        elif not quoted and ch == ')':
+            depth -= 1
+            if depth == 0:
+                chars.append(ch)
+                continue
+        chars.append(ch if depth == 0 and not quoted and ch != "'" else ' ')
+    return ''.join(chars)
+
+
+def _groups(mask):
+    """(start, end) of the top-level parenthesized groups"""
+    start = None
+    for i, ch in enumerate(mask):
+        if ch == '(':
+            start = i
+        elif ch == ')' and start is not None:
+            yield start, i
+            start = None
+
+
+def _split(text, pattern):
+    """Pieces of text between top-level matches of pattern"""
+    mask = _mask(text)
+    pieces, position = [], 0
+    for m in pattern.finditer(mask):
+        pieces.append(text[position:m.start()])
+        position = m.end()
+    pieces.append(text[position:])
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+
+def _scopes(sql):
+    """(FROM, WHERE) clauses of the statement and of every subquery in it"""
+    mask = _mask(sql)
+    start = FROM_RE.search(mask)
+    if SELECT_RE.match(sql) and start:
+        end = CLAUSE_END_RE.search(mask, start.end())
+        end = end.start() if end else len(sql)
+        where = WHERE_RE.search(mask, start.end(), end)
+        if where:
+            yield sql[start.end():where.start()], sql[where.end():end]
+        else:
+            yield sql[start.end():end], ''
+    for first, last in _groups(mask):
+        yield from _scopes(sql[first + 1:last])
+
+
+def _conditions(text):
+    """Top-level AND-ed conditions of text; parenthesized ANDs are flattened, ORs dropped"""
+    mask = _mask(text)
+    pieces, position, between = [], 0, False
+    for m in CONNECTIVE_RE.finditer(mask):
+        word = m.group(1).upper()
+        if word == 'OR':
+            return []
+        if word == 'BETWEEN':
+            between = True
+        elif between:
+            between = False
+        else:
+            pieces.append(text[position:m.start()])
+            position = m.end()
+    pieces.append(text[position:])
+
+    conditions = []
+    for piece in (piece.strip() for piece in pieces):
+        if piece.startswith('(') and _mask(piece).find(')') == len(piece) - 1:
+            conditions.extend(_conditions(piece[1:-1]))
+        elif piece:
+            conditions.append(' '.join(piece.split()))
+    return conditions
+
+
+def _tables(from_clause, columns):
+    """({alias: table} for the schema tables in a FROM clause, join conditions)"""
+    aliases, joins = {}, []
+    for piece in _split(from_clause, JOIN_RE):
+        on = _split(piece, ON_RE)
+        if len(on) > 1:
+            piece = on[0]
+            joins.extend(_conditions(on[1]))
+        m = TABLE_RE.match(piece)
+        if not m or m.group(1).lower() not in columns:
+            continue
+        table = m.group(1).lower()
+        alias = m.group(2)
+        aliases[table] = table
+        if alias and alias.upper() not in ('ON', 'WHERE', 'NATURAL'):
+            aliases[alias.lower()] = table
+    return aliases, joins
+
+
+def _refs(expression, aliases, columns):
+    """{(table, column)} for the column references in expression"""
+    found = set()
+    for qualifier, name in REF_RE.findall(LITERAL_RE.sub(' ', expression)):
+        name = name.lower()
+        if qualifier:
+            table = aliases.get(qualifier.lower())
+            tables = [table] if table and name in columns[table] else []
+        else:
+            tables = {table for table in aliases.values() if name in columns[table]}
+        if len(tables) == 1:
+            found.add((next(iter(tables)), name))
+    return found
+
+
+def _unqualified(text, aliases):
+    for alias in aliases:
+        text = re.sub(r'\b' + re.escape(alias) + r'\.', '', text, flags=re.IGNORECASE)
+    return text
+
+
+def _classify(condition, aliases, columns):
+    """(table, kind, index key, condition without qualifiers) or None"""
+    m = OPERATOR_RE.search(_mask(condition))
+    if not m:
+        return None
+    op = ' '.join((m.group(1) or m.group(2)).lower().split())
+    left, right = condition[:m.start()].strip(), condition[m.end():].strip()
+    kind = KINDS.get(op)
+    if kind is None:
+        return None
+    left_refs = _refs(left, aliases, columns)
+    right_refs = _refs(right, aliases, columns) if kind != 'eq' or op == '=' else set()
+    if not left_refs and len(right_refs) == 1 and op in ('=', *FLIPPED):
+        # 'value' < column
+        left, right, left_refs, right_refs = right, left, right_refs, set()
+        op = FLIPPED.get(op, op)
+    if len({table for table, _ in left_refs}) != 1 or VOLATILE_RE.search(left):
+        return None
+    if right_refs and kind != 'eq':
+        return None
+    if right_refs:
+        kind = 'join'
+    table = next(iter(left_refs))[0]
+    key = _unqualified(left, aliases)
+    # An expression key is written in parentheses
+    key = key.lower() if COLUMN_RE.match(key) else f"({key})"
+    return table, kind, key, _unqualified(condition, aliases)
+
+
+def predicates(sql, columns):
+    """{table: [(kind, key, condition)]} for the filters of sql and its subqueries"""
+    found = defaultdict(list)
+    for from_clause, where in _scopes(' '.join(sql.split())):
+        aliases, joins = _tables(from_clause, columns)
+        if not aliases:
+            continue
+        for condition in joins + _conditions(where):
+            parsed = _classify(condition, aliases, columns)
+            if parsed is not None:
+                table, kind, key, text = parsed
+                found[table].append((kind, key, text))
+            # Both sides of a join equality can use an index
+            m = OPERATOR_RE.search(_mask(condition))
+            if m and m.group(2) == '=':
+                right = condition[m.end():].strip()
+                refs = _refs(right, aliases, columns)
+                if COLUMN_RE.match(right) and len(refs) == 1:
+                    table, name = next(iter(refs))
+                    found[table].append(('join', name, _unqualified(condition, aliases)))
+    return found
+
+
+def _index_name(table, keys, where):
+    name = 'idx_adv_' + '_'.join([table] + re.findall(r'[a-z0-9]+', ' '.join(keys).lower()))
+    digest = hashlib.md5(f"{table} {keys} {where}".encode()).hexdigest()[:6]
+    if where:
+        name += '_' + digest
+    if len(name) > 63:
+        name = name[:56] + '_' + digest
+    return name
+
+
+def propose(group, columns):
+    """Proposed indexes for a shape: [{'table', 'keys', 'where', 'name'}]"""
+    statements = group['statements'][:50]
+    example = predicates(statements[0], columns)
+    others = [predicates(sql, columns) for sql in statements[1:]]
+    proposals = []
+    for table, conditions in example.items():
+        eq, joins, ranges, where = [], [], [], []
+        for kind, key, text in conditions:
+            # The same literal in every statement, while other literals vary
+            constant = others and all(text in [c for _, _, c in other[table]] for other in others)
+            if constant and kind in ('range', 'ne', 'null') and not VOLATILE_RE.search(text):
+                where.append(text)
+            elif kind == 'eq':
+                eq.append(key)
+            elif kind == 'join':
+                joins.append(key)
+            elif kind == 'range':
+                ranges.append(key)
+        # Filters on literals narrow the most, join keys come after them
+        keys = list(dict.fromkeys(eq + joins + ranges[:1]))
+        if not keys and where:
+            keys = [next(key for _, key, text in conditions if text == where[0])]
+        if keys:
+            where = list(dict.fromkeys(where))
+            proposals.append({'table': table, 'keys': keys, 'where': where,
+                              'name': _index_name(table, keys, where)})
+    return proposals
+
+
+def _normalized(key):
+    return re.sub(r'[\s()"]', '', key.lower())
+
+
+def _covered(proposal, existing):
+    """Whether an existing B-tree index has the proposal's keys as its leading keys"""
+    keys = [_normalized(key) for key in proposal['keys']]
+    where = _normalized(' AND '.join(proposal['where']))
+    for method, index_keys, index_where in existing.get(proposal['table'], ()):
+        if method == 'btree' and index_keys[:len(keys)] == keys and index_where in ('', where):
+            return True
+    return False
+
+
+def ddl(proposal, command='CREATE INDEX'):
+    sql = f"{command} {proposal['name']} ON {proposal['table']} ({', '.join(proposal['keys'])})"
+    if proposal['where']:
+        sql += f" WHERE {' AND '.join(proposal['where'])}"
+    return sql
+
+
+async def _schema(conn):
+    columns = defaultdict(set)
+    for record in await conn.fetch(
+        "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = current_schema()"
+    ):
+        columns[record['table_name']].add(record['column_name'])
+    existing = defaultdict(list)
+    for record in await conn.fetch(
+        "SELECT tablename, indexdef FROM pg_indexes WHERE schemaname = current_schema()"
+    ):
+        definition, _, where = record['indexdef'].partition(' WHERE ')
+        definition = definition.split(' INCLUDE (')[0]
+        m = re.search(r' USING (\w+) \((.*)\)$', definition)
+        if m:
+            keys = [_normalized(key) for key in _split(m.group(2), re.compile(','))]
+            existing[record['tablename']].append((m.group(1), keys, _normalized(where)))
+    hypopg = await conn.fetchval("SELECT count(*) FROM pg_extension WHERE extname = 'hypopg'")
+    return columns, existing, bool(hypopg)
+
+
+def _summary(nodes):
+    """Scan nodes with the ones repeated per partition counted once"""
+    counts = {}
+    for node in nodes:
+        node = PARTITION_RE.sub('_*', node)
+        counts[node] = counts.get(node, 0) + 1
+    return ', '.join(f"{count}x {node}" if count > 1 else node for node, count in counts.items()) or 'no scans'
+
+
+async def _explain(conn, statements):
+    """(mean total cost, scan nodes of the first statement)"""
+    costs, nodes = [], None
+    for sql in statements:
+        plan = json.loads(await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}"))[0]['Plan']
+        costs.append(plan['Total Cost'])
+        nodes = plan_nodes(plan) if nodes is None else nodes
+    return statistics.mean(costs), nodes
+
+
+async def _explain_with(conn, proposal, statements, hypopg, build_timeout_ms):
+    """_explain as if the proposed index existed"""
+    if hypopg:
+        await conn.fetchval("SELECT indexrelid FROM hypopg_create_index($1)", ddl(proposal))
+        try:
+            return await _explain(conn, statements)
+        finally:
+            await conn.execute("SELECT hypopg_reset()")
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        await conn.execute(f"SET LOCAL lock_timeout = {BUILD_LOCK_TIMEOUT_MS}")
+        await conn.execute(f"SET LOCAL statement_timeout = {int(build_timeout_ms)}")
+        await conn.execute(ddl(proposal))
+        if any(not COLUMN_RE.match(key) for key in proposal['keys']):
+            # Statistics on the indexed expression; rolled back with the index
+            await conn.execute(f"ANALYZE {proposal['table']}")
+        return await _explain(conn, statements)
+    finally:
+        await transaction.rollback()
+
+
+async def _create_statement(conn, proposal):
+    # CONCURRENTLY is not supported on a partitioned table
+    if await conn.fetchval("SELECT relkind = 'p' FROM pg_class WHERE oid = $1::regclass", proposal['table']):
+        return ddl(proposal, 'CREATE INDEX IF NOT EXISTS')
+    return ddl(proposal, 'CREATE INDEX CONCURRENTLY IF NOT EXISTS')
+
+
+async def _create(conn, proposal):
+    statement = await _create_statement(conn, proposal)
+    await conn.execute(statement)
+    await conn.execute(f"ANALYZE {proposal['table']}")
+    return statement
+
+
+def select_slow(groups, args):
+    slow = [group for group in groups if group['count'] >= args.min_count
+            and (group['median_ms'] >= args.min_ms or group['timeouts'] or group['rejected'])]
+    # A rejected shape failed every time it was asked, whatever its latency
+    return sorted(slow, key=lambda group: (group['rejected'] > 0, group['total_ms']), reverse=True)[:args.top]
+
+
+async def run(args):
+    groups = group_log(read_log(args.log))
+    slow = select_slow(groups, args)
+    print(f"{sum(group['count'] for group in groups)} statements, {len(groups)} shapes, {len(slow)} slow")
+    if not slow:
+        return
+
+    recommended = []
+    await db.connect()
+    try:
+        async with db.acquire() as conn:
+            columns, existing, hypopg = await _schema(conn)
+            estimate = hypopg or args.build_real_indexes
+            if not estimate:
+                print("hypopg unavailable: proposals are listed without estimates; "
+                      "--build-real-indexes builds each one to estimate it")
+            for rank, group in enumerate(slow, 1):
+                print(f"\n[{rank}] {group['count']} runs, median {group['median_ms']:.1f} ms, "
+                      f"total {group['total_ms'] / 1000:.1f} s, {group['timeouts']} timeouts, "
+                      f"{group['rejected']} over budget")
+                print(f"    {group['shape']}")
+                statements = group['statements'][:args.samples]
+                try:
+                    before, nodes = await _explain(conn, statements)
+                except asyncpg.PostgresError as e:
+                    print(f"    cannot be planned: {e}")
+                    continue
+                print(f"    cost {before:.1f}: {_summary(nodes)}")
+                proposals = [p for p in propose(group, columns) if not _covered(p, existing)]
+                if not proposals:
+                    print("    no index to propose")
+                for proposal in proposals:
+                    print(f"    {ddl(proposal)}")
+                    if not estimate:
+                        continue
+                    try:
+                        after, after_nodes = await _explain_with(conn, proposal, statements, hypopg,
+                                                                 args.build_timeout_ms)
+                    except asyncpg.PostgresError as e:
+                        print(f"      failed: {e}")
+                        continue
+                    gain = 1 - after / before if before else 0.0
+                    print(f"      cost {before:.1f} -> {after:.1f} ({gain:.0%} saved): {_summary(after_nodes)}")
+                    if gain < args.min_gain:
+                        continue
+                    if args.create:
+                        try:
+                            recommended.append(await _create(conn, proposal))
+                        except asyncpg.PostgresError as e:
+                            print(f"      create failed: {e}")
+                            continue
+                        print("      created")
+                    else:
+                        recommended.append(await _create_statement(conn, proposal))
+                    keys = [_normalized(key) for key in proposal['keys']]
+                    existing[proposal['table']].append(
+                        ('btree', keys, _normalized(' AND '.join(proposal['where']))))
+    finally:
+        await db.close()
+
+    if recommended:
+        print("\nRecommended indexes:" if not args.create else "\nCreated indexes:")
+        for statement in dict.fromkeys(recommended):
+            print(f"  {statement};")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose indexes for slow query shapes in the query log")
+    parser.add_argument("log", nargs="?", default=QUERY_LOG_PATH, help="query log, QUERY_LOG_PATH by default")
+    parser.add_argument("--min-count", type=int, default=3, help="runs of a shape to consider it")
+    parser.add_argument("--min-ms", type=float, default=50, help="median latency of a slow shape")
+    parser.add_argument("--top", type=int, default=10, help="slow shapes to analyze, by total time")
+    parser.add_argument("--samples", type=int, default=3, help="statements of a shape whose cost is averaged")
+    parser.add_argument("--min-gain", type=float, default=0.2,
+                        help="share of the estimated cost an index must save to be recommended")
+    parser.add_argument("--create", action="store_true", help="build the recommended indexes")
+    parser.add_argument("--build-real-indexes", action="store_true",
+                        help="without hypopg, estimate by building each index in a rolled-back transaction")
+    parser.add_argument("--build-timeout-ms", type=int, default=60000,
+                        help="statement_timeout of an index built to be estimated")
+    args = parser.parse_args()
+    if not args.log:
+        parser.error("no query log given and QUERY_LOG_PATH is not set")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Rule-based question-to-SQL matching that runs ahead of the model.
+
+Questions are parsed once into features (metric, video id, creator, dates,
+comparisons) with precompiled patterns, then checked against a declarative
+table of intents. A confident match is answered without model.generate.
+"""
+import re
+from calendar import monthrange
+
+MONTHS = {
+    'января': '01', 'февраля': '02', 'марта': '03', 'апреля': '04',
+    'мая': '05', 'июня': '06', 'июля': '07', 'августа': '08',
+    'сентября': '09', 'октября': '10', 'ноября': '11', 'декабря': '12',
+}
+# Stems for "в ноябре 2025" / "за ноябрь 2025"; март before ма(й)
+MONTH_STEMS = {
+    'январ': 1, 'феврал': 2, 'март': 3, 'апрел': 4, 'ма': 5, 'июн': 6,
+    'июл': 7, 'август': 8, 'сентябр': 9, 'октябр': 10, 'ноябр': 11, 'декабр': 12,
+}
+METRICS = {
+    'просмотр': 'views_count',
+    'лайк': 'likes_count',
+    'коммент': 'comments_count',
+    'жалоб': 'reports_count',
+}
+# Longest phrases first so "не более" is not read as "более"
+COMPARISONS = {
+    'не менее': '>=', 'не более': '<=', 'не меньше': '>=', 'не больше': '<=',
+    'больше': '>', 'более': '>', 'свыше': '>', 'меньше': '<', 'менее': '<',
+    'от': '>=', 'до': '<=',
+}
+
+_MONTH = '(' + '|'.join(MONTHS) + ')'
+_METRIC = '(' + '|'.join(METRICS) + r')\w*'
+_NUMBER = r'(\d+(?:[ ,]\d{3})*)'
+
+DATE_RE = re.compile(r'\b(\d{1,2})\s+' + _MONTH + r'\s+(\d{4})\b', re.IGNORECASE)
+DATE_RANGE_RE = re.compile(
+    r'\bс\s+(\d{1,2})(?:\s+' + _MONTH + r')?(?:\s+(\d{4}))?\s+по\s+(\d{1,2})\s+' + _MONTH + r'\s+(\d{4})\b'
+)
+MONTH_RE = re.compile(r'\b(?:в|во|за)\s+(' + '|'.join(MONTH_STEMS) + r')\w*\s+(\d{4})\b')
+VIDEO_ID_RE = re.compile(r'\b[a-f0-9-]{36}\b')
+CREATOR_RE = re.compile(r'креатора\s+с\s+id\s+([\w-]+)')
+COMPARISON_RE = re.compile(
+    r'\b(' + '|'.join(COMPARISONS) + r')\s+' + _NUMBER + r'\s+' + _METRIC
+)
+METRIC_RE = re.compile(_METRIC)
+QUESTION_RE = re.compile(r'сколько|количеств|как(?:ой|ов)\s+(?:был\s+)?(?:общий\s+|суммарный\s+)?прирост')
+PUBLISHED_RE = re.compile(r'опубликова|вышл|вышед|выложен|загружен|создан')
+# Aggregates and groupings the templates below cannot express
+UNSUPPORTED_RE = re.compile(
+    r'средн|максимал|минимал|наибол|наимен|топ\b|кажд|по дням|по месяц|групп|процент|дол[яию]\b|какие|чей|чьи'
+)
+# Words left over after parsing that change what is asked: a comparison
+# without a number and metric, negation, an open date range, a relative date
+UNREAD_RE = re.compile(
+    r'\b(?:больше|более|меньше|менее|свыше|выше|ниже)\b'
+    r'|\b(?:не|ни|без)\b'
+    r'|\b(?:после|до|раньше|позже|позднее|ранее|начиная)\b'
+    r'|вчера|сегодня|недел|последн|прошл|текущ|\bэтом\s+(?:году|месяце)'
+)
+
+
+def russian_date(day: str, month: str, year: str) -> str:
+    """'28', 'ноября', '2025' -> '2025-11-28'"""
+    return f"{year}-{MONTHS[month.lower()]}-{day.zfill(2)}"
+
+
+def _parse_dates(q, consumed):
+    """Return (first_day, last_day) as ISO strings, or None"""
+    m = DATE_RANGE_RE.search(q)
+    if m:
+        d1, m1, y1, d2, m2, y2 = m.groups()
+        consumed.append(m.span())
+        return russian_date(d1, m1 or m2, y1 or y2), russian_date(d2, m2, y2)
+    m = DATE_RE.search(q)
+    if m:
+        consumed.append(m.span())
+        day = russian_date(*m.groups())
+        return day, day
+    m = MONTH_RE.search(q)
+    if m:
+        consumed.append(m.span())
+        month, year = MONTH_STEMS[m.group(1)], int(m.group(2))
+        last = monthrange(year, month)[1]
+        return f"{year}-{month:02d}-01", f"{year}-{month:02d}-{last:02d}"
+    return None
+
+
+def parse_question(question: str) -> dict:
+    q = question.lower()
+    consumed = []
+    features = {'text': q}
+
+    m = VIDEO_ID_RE.search(q)
+    features['video_id'] = m.group(0) if m else None
+    if m:
+        consumed.append(m.span())
+
+    m = CREATOR_RE.search(q)
+    features['creator_id'] = m.group(1) if m else None
+    if m:
+        consumed.append(m.span())
+
+    features['dates'] = _parse_dates(q, consumed)
+
+    comparisons = []
+    for m in COMPARISON_RE.finditer(q):
+        op, number, stem = m.groups()
+        comparisons.append((METRICS[stem], COMPARISONS[op], int(re.sub(r'[ ,]', '', number))))
+        consumed.append(m.span())
+    features['comparisons'] = comparisons
+
+    # The metric a question is about, ignoring ones used in comparisons
+    rest = q
+    for start, end in sorted(consumed, reverse=True):
+        rest = rest[:start] + ' ' + rest[end:]
+    features['metrics'] = [METRICS[stem] for stem in METRIC_RE.findall(rest)]
+    features['metric'] = features['metrics'][0] if features['metrics'] else None
+    features['leftover_literals'] = bool(re.search(r'\d', rest))
+    features['rest'] = rest
+    return features
+
+
+def _date_filter(column, dates):
+    first, last = dates
+    if first == last:
+        return f"DATE({column}) = '{first}'"
+    return f"DATE({column}) BETWEEN '{first}' AND '{last}'"
+
+
+def _videos_filters(f):
+    filters = []
+    if f['creator_id']:
+        filters.append(f"creator_id = '{f['creator_id']}'")
+    for column, op, value in f['comparisons']:
+        filters.append(f"{column} {op} {value}")
+    if f['dates'] and PUBLISHED_RE.search(f['text']):
+        filters.append(_date_filter('video_created_at', f['dates']))
+    return filters
+
+
+def _snapshots_filters(f):
+    filters = [_date_filter('created_at', f['dates'])]
+    if f['creator_id']:
+        filters.append(f"video_id IN (SELECT id FROM videos WHERE creator_id = '{f['creator_id']}')")
+    return filters
+
+
+# Checked in order; the first intent whose trigger and requirements match wins.
+# 'filters' builds the WHERE conditions, 'conditions' are appended after them.
+INTENTS = (
+    {
+        'name': 'video_metric',
+        'trigger': re.compile(r'видео'),
+        'requires': ('metric', 'video_id'),
+        'sql': "SELECT {metric} FROM videos WHERE id = '{video_id}'",
+    },
+    {
+        'name': 'videos_with_new_metric',
+        'trigger': re.compile(r'разн\w*\s+видео|нов\w*\s+' + _METRIC),
+        'requires': ('metric', 'dates'),
+        'filters': _snapshots_filters,
+        'conditions': ('delta_{metric} > 0',),
+        'sql': "SELECT COUNT(DISTINCT video_id) FROM video_snapshots{where}",
+        'snapshots': True,
+    },
+    {
+        'name': 'metric_growth',
+        'trigger': re.compile(r'вырос|прирост|прибав|увеличил'),
+        'requires': ('metric', 'dates'),
+        'filters': _snapshots_filters,
+        'sql': "SELECT COALESCE(SUM(delta_{metric}), 0) FROM video_snapshots{where}",
+        'snapshots': True,
+    },
+    {
+        'name': 'metric_total',
+        'trigger': re.compile(r'сколько\s+(?:всего\s+)?' + _METRIC),
+        'requires': ('metric',),
+        'filters': _videos_filters,
+        'sql': "SELECT COALESCE(SUM({metric}), 0) FROM videos{where}",
+    },
+    {
+        'name': 'video_count',
+        'trigger': re.compile(r'(?:сколько|количеств\w*)\s+(?:всего\s+)?видео'),
+        'requires': (),
+        'filters': _videos_filters,
+        'sql': "SELECT COUNT(*) FROM videos{where}",
+    },
+)
+
+
+def _confident(intent, f):
+    q = f['text']
+    if not QUESTION_RE.search(q) or UNSUPPORTED_RE.search(q) or f['leftover_literals']:
+        return False
+    if UNREAD_RE.search(f['rest']):
+        return False
+    # Every metric and id mentioned must have a place in the intent's SQL
+    if len(set(f['metrics'])) > ('metric' in intent['requires']):
+        return False
+    if f['video_id'] and intent['name'] != 'video_metric':
+        return False
+    if intent.get('snapshots'):
+        # Snapshot intents have no place for value comparisons
+        return not f['comparisons']
+    if intent['name'] == 'video_metric':
+        return not (f['creator_id'] or f['comparisons'] or f['dates'])
+    # A date on a videos question must be about publishing
+    return not f['dates'] or bool(PUBLISHED_RE.search(q))
+
+
+def match_intent(question: str, strict: bool = True):
+    """Return SQL for the first matching intent, or None.
+
+    With strict=True only confident matches are returned: the question must
+    be a count question, use no unsupported aggregate and have every literal,
+    metric and qualifier accounted for; an intent that is not confident
+    passes the question on to the next one. strict=False is the best-effort
+    mode used as a fallback.
+    """
+    f = parse_question(question)
+    for intent in INTENTS:
+        if not intent['trigger'].search(f['text']):
+            continue
+        if not all(f[name] for name in intent['requires']):
+            continue
+        if strict and not _confident(intent, f):
+            continue
+        values = {'metric': f['metric'], 'video_id': f['video_id']}
+        filters = intent['filters'](f) if 'filters' in intent else []
+        filters += [c.format(**values) for c in intent.get('conditions', ())]
+        values['where'] = ' WHERE ' + ' AND '.join(filters) if filters else ''
+        return intent['sql'].format(**values)
+    return None
@@ -1,53 +1,425 @@
 import asyncio
 import json
-from datetime import datetime
+import os
+import re
+import time
+from datetime import date, datetime
 from database import db
+from video_replica import replica
 
+# Rows per COPY batch and number of pool connections copying in parallel
+BATCH_SIZE = int(os.getenv('LOAD_BATCH_SIZE', 10000))
+LOAD_WORKERS = int(os.getenv('LOAD_WORKERS', 4))
+READ_CHUNK_SIZE = 1 << 20
+PARTIAL_TOKEN_RE = re.compile(r'[^\s,:\[\]{}"]*')
 
-async def load_json_to_db(json_file_path: str):
-    await db.connect()
-    await db.create_tables()
+VIDEO_COLUMNS = (
+    'id', 'creator_id', 'video_created_at', 'views_count', 'likes_count',
+    'comments_count', 'reports_count', 'created_at', 'updated_at',
+)
+SNAPSHOT_COLUMNS = (
+    'video_id', 'views_count', 'likes_count', 'comments_count', 'reports_count',
+    'delta_views_count', 'delta_likes_count', 'delta_comments_count', 'delta_reports_count',
+    'created_at', 'updated_at',
+)
+# Where snapshots are copied before being moved into monthly partitions
+SNAPSHOT_STAGING_TABLE = 'video_snapshots_staging'
 
+
+def _truncated(buf, error) -> bool:
+    """Whether a decode error can come from buf ending mid-value"""
+    if error.msg.startswith('Unterminated string'):
+        return True
+    # At the end of the buffer, or inside a last token cut short (e.g. 'tru', '12e')
+    return PARTIAL_TOKEN_RE.fullmatch(buf, error.pos) is not None
+
+
+class _JsonStreamReader:
+    """Incremental JSON reader that decodes one array element at a time.
+
+    Only the element being decoded is held in memory, so a multi-GB
+    videos.json costs as much RAM as its largest single video.
+    """
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character ('' at EOF)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid JSON: expected {char!r}, got {found!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                # Only an error where the buffered text runs out may be fixed by
+                # reading more; anything else is malformed and would otherwise
+                # pull the rest of the file into the buffer
+                if not _truncated(self.buf, e) or not self._fill():
+                    raise
+                continue
+            # A number ending exactly at the buffer edge may be truncated
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+
+def iter_videos(json_file_path: str):
+    """Yield videos from either a top-level array or a {"videos": [...]} object"""
     with open(json_file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    videos = data if isinstance(data, list) else data.get('videos', [])
-    print(f"Found videos: {len(videos)}")
-
-    async with db.pool.acquire() as conn:
-        await conn.execute("TRUNCATE TABLE video_snapshots CASCADE")
-        await conn.execute("TRUNCATE TABLE videos CASCADE")
-
-        for video in videos:
-            await conn.execute("""
-                INSERT INTO videos (id, creator_id, video_created_at, views_count, likes_count, comments_count, reports_count, created_at, updated_at)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
-                ON CONFLICT (id) DO UPDATE SET
-                    creator_id = EXCLUDED.creator_id, video_created_at = EXCLUDED.video_created_at,
-                    views_count = EXCLUDED.views_count, likes_count = EXCLUDED.likes_count,
-                    comments_count = EXCLUDED.comments_count, reports_count = EXCLUDED.reports_count,
-                    updated_at = CURRENT_TIMESTAMP
-            """, video['id'], video['creator_id'],
-                datetime.fromisoformat(video['video_created_at'].replace('Z', '+00:00')).replace(tzinfo=None),
-                video['views_count'], video['likes_count'], video['comments_count'], video['reports_count'],
-                datetime.fromisoformat(video.get('created_at', video['video_created_at']).replace('Z', '+00:00')).replace(tzinfo=None),
-                datetime.fromisoformat(video.get('updated_at', video['video_created_at']).replace('Z', '+00:00')).replace(tzinfo=None))
-
-            for snapshot in video.get('snapshots', []):
-                await conn.execute("""
-                    INSERT INTO video_snapshots (video_id, views_count, likes_count, comments_count, reports_count,
-                        delta_views_count, delta_likes_count, delta_comments_count, delta_reports_count, created_at, updated_at)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                """, video['id'], snapshot['views_count'], snapshot['likes_count'], snapshot['comments_count'],
-                    snapshot['reports_count'], snapshot.get('delta_views_count', 0), snapshot.get('delta_likes_count', 0),
-                    snapshot.get('delta_comments_count', 0), snapshot.get('delta_reports_count', 0),
-                    datetime.fromisoformat(snapshot['created_at'].replace('Z', '+00:00')).replace(tzinfo=None),
-                    datetime.fromisoformat(snapshot.get('updated_at', snapshot['created_at']).replace('Z', '+00:00')).replace(tzinfo=None))
-
-    print(f"Loaded {len(videos)} videos")
-    await db.close()
+        reader = _JsonStreamReader(f)
+        if reader.peek() != '{':
+            yield from reader.array()
+            return
+
+        reader.expect('{')
+        while reader.peek() != '}':
+            key = reader.value()
+            reader.expect(':')
+            if key == 'videos':
+                yield from reader.array()
+            else:
+                reader.value()
+            if reader.peek() == ',':
+                reader.pos += 1
+
+
+def parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+def video_record(video: dict) -> tuple:
+    return (
+        video['id'], video['creator_id'], parse_timestamp(video['video_created_at']),
+        video['views_count'], video['likes_count'], video['comments_count'], video['reports_count'],
+        parse_timestamp(video.get('created_at', video['video_created_at'])),
+        parse_timestamp(video.get('updated_at', video['video_created_at'])),
+    )
+
+
+def snapshot_record(video_id: str, snapshot: dict) -> tuple:
+    return (
+        video_id, snapshot['views_count'], snapshot['likes_count'], snapshot['comments_count'],
+        snapshot['reports_count'], snapshot.get('delta_views_count', 0), snapshot.get('delta_likes_count', 0),
+        snapshot.get('delta_comments_count', 0), snapshot.get('delta_reports_count', 0),
+        parse_timestamp(snapshot['created_at']),
+        parse_timestamp(snapshot.get('updated_at', snapshot['created_at'])),
+    )
+
+
+def iter_batches(json_file_path: str, batch_size: int = BATCH_SIZE, repeated: list = None):
+    """Group converted rows into (videos, snapshots) batches of about batch_size rows.
+
+    A video always travels in the same batch as its snapshots, so copying a
+    batch's videos before its snapshots satisfies the foreign key. With a
+    repeated list, a video whose id was already yielded is appended there
+    with its snapshots, as a (video, snapshots) pair, instead of to a batch,
+    so no id reaches COPY twice.
+    """
+    seen = set()
+    videos, snapshots = [], []
+    for video in iter_videos(json_file_path):
+        record = video_record(video)
+        video_snapshots = [snapshot_record(video['id'], s) for s in video.get('snapshots', [])]
+        if repeated is not None:
+            if record[0] in seen:
+                repeated.append((record, video_snapshots))
+                continue
+            seen.add(record[0])
+        videos.append(record)
+        snapshots.extend(video_snapshots)
+        if len(videos) + len(snapshots) >= batch_size:
+            yield videos, snapshots
+            videos, snapshots = [], []
+    if videos:
+        yield videos, snapshots
+
+
+async def _copy_worker(queue: asyncio.Queue, totals: dict, errors: list, snapshots_table: str):
+    async with db.acquire() as conn:
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            if errors:
+                # Keep draining so the producer never blocks on a full queue
+                continue
+            videos, snapshots = batch
+            try:
+                await conn.copy_records_to_table('videos', records=videos, columns=VIDEO_COLUMNS)
+                if snapshots:
+                    await conn.copy_records_to_table(snapshots_table, records=snapshots, columns=SNAPSHOT_COLUMNS)
+            except Exception as e:
+                errors.append(e)
+                continue
+            totals['videos'] += len(videos)
+            totals['snapshots'] += len(snapshots)
+
+
+def snapshot_months(snapshots) -> set:
+    """First days of the months the snapshot records fall in"""
+    return {date(s[-2].year, s[-2].month, 1) for s in snapshots}
+
+
+async def _move_staged_snapshots():
+    """Insert staged snapshots month by month in created_at order, in parallel.
+
+    Copy order follows videos.json (video by video), so rows are sorted on
+    the way into the partitions; that physical order is what keeps the
+    BRIN index on created_at selective.
+    """
+    async with db.acquire() as conn:
+        months = [r[0] for r in await conn.fetch(
+            f"SELECT DISTINCT date_trunc('month', created_at)::date FROM {SNAPSHOT_STAGING_TABLE}"
+        )]
+    await db.ensure_partitions(months)
+    columns = ', '.join(SNAPSHOT_COLUMNS)
+
+    async def move(month):
+        async with db.acquire() as conn:
+            await conn.execute(f"""
+                INSERT INTO video_snapshots ({columns})
+                SELECT {columns} FROM {SNAPSHOT_STAGING_TABLE}
+                WHERE created_at >= $1::date AND created_at < $1::date + INTERVAL '1 month'
+                ORDER BY created_at
+            """, month)
+
+    await asyncio.gather(*(move(month) for month in months))
+    async with db.acquire() as conn:
+        await conn.execute(f"DROP TABLE {SNAPSHOT_STAGING_TABLE}")
+
+
+async def _upsert_repeated(repeated, snapshots_table):
+    """Apply videos that occur more than once in the file, in file order.
+
+    As with a row-by-row upsert the last record of an id wins, and the
+    snapshots of every occurrence are kept.
+    """
+    columns = ', '.join(VIDEO_COLUMNS)
+    placeholders = ', '.join(f'${i}' for i in range(1, len(VIDEO_COLUMNS) + 1))
+    async with db.acquire() as conn:
+        await conn.executemany(f"""
+            INSERT INTO videos ({columns}) VALUES ({placeholders})
+            ON CONFLICT (id) DO UPDATE SET
+                creator_id = EXCLUDED.creator_id, video_created_at = EXCLUDED.video_created_at,
+                views_count = EXCLUDED.views_count, likes_count = EXCLUDED.likes_count,
+                comments_count = EXCLUDED.comments_count, reports_count = EXCLUDED.reports_count,
+                updated_at = CURRENT_TIMESTAMP
+        """, [video for video, _ in repeated])
+        snapshots = [s for _, video_snapshots in repeated for s in video_snapshots]
+        if snapshots:
+            await conn.copy_records_to_table(snapshots_table, records=snapshots, columns=SNAPSHOT_COLUMNS)
+    print(f"Upserted {len(repeated)} repeated videos with {len(snapshots)} snapshots")
+    return len(snapshots)
+
+
+async def load_json_to_db(json_file_path: str, partitioned: bool = None):
+    owns_pool = await db.connect()
+    try:
+        return await _load_json(json_file_path, partitioned)
+    finally:
+        if owns_pool:
+            await db.close()
+
+
+async def _load_json(json_file_path, partitioned):
+    await db.create_tables(partitioned=partitioned)
+    await db.drop_indexes()
+    snapshots_table = 'video_snapshots'
+    if await db.snapshots_partitioned():
+        snapshots_table = SNAPSHOT_STAGING_TABLE
+        async with db.acquire() as conn:
+            await conn.execute(f"DROP TABLE IF EXISTS {snapshots_table}")
+            await conn.execute(
+                f"CREATE UNLOGGED TABLE {snapshots_table} AS "
+                f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM video_snapshots WITH NO DATA"
+            )
+
+    started = time.perf_counter()
+    totals = {'videos': 0, 'snapshots': 0}
+    errors = []
+    # Bounded queue keeps at most a couple of batches per worker in memory
+    queue = asyncio.Queue(maxsize=LOAD_WORKERS * 2)
+    workers = [
+        asyncio.create_task(_copy_worker(queue, totals, errors, snapshots_table))
+        for _ in range(LOAD_WORKERS)
+    ]
+
+    loop = asyncio.get_running_loop()
+    # Filled by the parser thread, applied once every batch is copied
+    repeated = []
+    batches = iter_batches(json_file_path, repeated=repeated)
+    try:
+        while not errors:
+            # Parsing is CPU-bound, so it runs off the loop while workers copy
+            batch = await loop.run_in_executor(None, next, batches, None)
+            if batch is None:
+                break
+            await queue.put(batch)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    except BaseException:
+        for w in workers:
+            w.cancel()
+        raise
+    if errors:
+        raise errors[0]
+    if repeated:
+        totals['snapshots'] += await _upsert_repeated(repeated, snapshots_table)
+    if snapshots_table != 'video_snapshots':
+        await _move_staged_snapshots()
+
+    elapsed = time.perf_counter() - started
+    rows = totals['videos'] + totals['snapshots']
+    print(f"Loaded {totals['videos']} videos and {totals['snapshots']} snapshots "
+          f"in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/sec)")
+
+    index_started = time.perf_counter()
+    await db.create_indexes()
+    await db.refresh_rollups()
+    async with db.acquire() as conn:
+        await conn.execute("ANALYZE videos")
+        await conn.execute("ANALYZE video_snapshots")
+        await conn.execute("ANALYZE daily_video_stats")
+        await conn.execute("ANALYZE daily_snapshot_stats")
+    print(f"Indexes and rollups rebuilt in {time.perf_counter() - index_started:.1f}s")
+    await replica.refresh_after_load()
+    return totals
+
+
+async def sync_json_to_db(json_file_path: str):
+    """Apply only the changes in json_file_path to the stored data.
+
+    Videos are upserted by id (rows whose values did not change are left
+    alone) and only snapshots newer than the latest stored snapshot of their
+    video are appended, and the daily rollups are rebuilt for the days that
+    got new snapshots. Everything runs in one transaction, so readers keep
+    seeing the previous state until the sync commits.
+    """
+    owns_pool = await db.connect()
+    try:
+        await _sync_json(json_file_path)
+    finally:
+        if owns_pool:
+            await db.close()
+
+
+async def _sync_json(json_file_path):
+    await db.create_tables(drop=False)
+
+    started = time.perf_counter()
+    inserted = updated = new_snapshots = 0
+    touched_days = set()
+    loop = asyncio.get_running_loop()
+    batches = iter_batches(json_file_path)
+
+    async with db.acquire() as conn:
+        partitioned = await db.snapshots_partitioned(conn)
+        async with conn.transaction():
+            latest = dict(await conn.fetch(
+                "SELECT video_id, MAX(created_at) FROM video_snapshots GROUP BY video_id"
+            ))
+            await conn.execute(
+                "CREATE TEMP TABLE videos_incoming (LIKE videos INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            columns = ', '.join(VIDEO_COLUMNS)
+            changed = ' OR '.join(f"videos.{c} IS DISTINCT FROM EXCLUDED.{c}" for c in VIDEO_COLUMNS[1:7])
+
+            while True:
+                batch = await loop.run_in_executor(None, next, batches, None)
+                if batch is None:
+                    break
+                videos, snapshots = batch
+                # One INSERT cannot update a row twice; the last record of an id wins
+                videos = list({v[0]: v for v in videos}.values())
+
+                await conn.copy_records_to_table('videos_incoming', records=videos, columns=VIDEO_COLUMNS)
+                # xmax = 0 only for freshly inserted rows
+                rows = await conn.fetch(f"""
+                    INSERT INTO videos ({columns})
+                    SELECT {columns} FROM videos_incoming
+                    ON CONFLICT (id) DO UPDATE SET
+                        creator_id = EXCLUDED.creator_id, video_created_at = EXCLUDED.video_created_at,
+                        views_count = EXCLUDED.views_count, likes_count = EXCLUDED.likes_count,
+                        comments_count = EXCLUDED.comments_count, reports_count = EXCLUDED.reports_count,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE {changed}
+                    RETURNING (xmax = 0) AS inserted
+                """)
+                await conn.execute("TRUNCATE videos_incoming")
+                batch_inserted = sum(1 for r in rows if r['inserted'])
+                inserted += batch_inserted
+                updated += len(rows) - batch_inserted
+
+                # Snapshot record layout: video_id first, created_at second to last
+                fresh = [s for s in snapshots if latest.get(s[0]) is None or s[-2] > latest[s[0]]]
+                if fresh:
+                    # Appended in time order, which keeps BRIN ranges on created_at tight
+                    fresh.sort(key=lambda s: s[-2])
+                    if partitioned:
+                        await db.ensure_partitions(snapshot_months(fresh), conn)
+                    await conn.copy_records_to_table('video_snapshots', records=fresh, columns=SNAPSHOT_COLUMNS)
+                    new_snapshots += len(fresh)
+                    touched_days.update(s[-2].date() for s in fresh)
+
+            # Rollups missing on a database loaded before they existed get a full build
+            rollups_empty = not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM daily_snapshot_stats)")
+            if rollups_empty:
+                await db.refresh_rollups(conn)
+            elif touched_days:
+                await db.refresh_rollups(conn, touched_days)
+
+    elapsed = time.perf_counter() - started
+    print(f"Synced in {elapsed:.1f}s: {inserted} new videos, {updated} updated videos, "
+          f"{new_snapshots} new snapshots")
+    await replica.refresh_after_load()
 
 
 if __name__ == "__main__":
     import sys
-    asyncio.run(load_json_to_db(sys.argv[1] if len(sys.argv) > 1 else "videos.json"))
+    args = [a for a in sys.argv[1:] if a != '--sync']
+    loader = sync_json_to_db if '--sync' in sys.argv[1:] else load_json_to_db
+    asyncio.run(loader(args[0] if args else "videos.json"))
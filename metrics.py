@@ -0,0 +1,216 @@
+"""Request tracing, latency histograms and a Prometheus text endpoint.
+
+Each question gets a Trace that collects how long it spent in every stage
+(queue, embed, tokenize, generate, cleanup, fallback, validate, replica,
+db_acquire, db_execute). When the request finishes the stages feed the
+histograms below, the outcome (rules, cache, semantic, model, fallback,
+error) is counted, and requests slower than SLOW_REQUEST_MS are written to
+the slow log.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 0))
+SLOW_LOG_PATH = os.getenv('SLOW_LOG_PATH')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts, sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ('le',)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.func()}"]
+
+
+REQUESTS = Counter('sqlbot_requests_total', 'Answered questions by outcome', ('outcome',))
+REQUEST_SECONDS = Histogram('sqlbot_request_duration_seconds', 'End-to-end time per question')
+STAGE_SECONDS = Histogram('sqlbot_stage_duration_seconds', 'Time per question spent in each stage', ('stage',))
+REGISTRY = [REQUESTS, REQUEST_SECONDS, STAGE_SECONDS]
+
+
+def register_pool(stats):
+    """Expose pool saturation from a Database.pool_stats-like callable"""
+    for key, help in (
+        ('size', 'Open pool connections'),
+        ('in_use', 'Pool connections checked out'),
+        ('waiting', 'Tasks waiting for a pool connection'),
+        ('acquire_timeouts', 'Pool acquires that timed out'),
+    ):
+        REGISTRY.append(Gauge(f'sqlbot_db_pool_{key}', help, lambda key=key: stats()[key]))
+
+
+def register_scheduler(stats):
+    """Expose queue depth and load shedding from an SQLBatcher.stats-like callable"""
+    for key, help in (
+        ('queued', 'Questions waiting for SQL generation'),
+        ('chats', 'Chats with questions waiting for SQL generation'),
+        ('batch_seconds', 'Moving average duration of a generation batch'),
+        ('shed', 'Questions shed under load'),
+        ('shed_wait_budget', 'Questions shed because their projected wait exceeded the budget'),
+        ('shed_queue_full', 'Questions shed because the queue was full'),
+        ('shed_chat_queue_full', 'Questions shed because their chat had too many queued'),
+        ('shed_deadline', 'Questions shed after waiting past their deadline'),
+        ('rejected', 'Shed questions rejected instead of answered by the fallback'),
+    ):
+        REGISTRY.append(Gauge(f'sqlbot_scheduler_{key}', help, lambda key=key: stats()[key]))
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """Stage timings and outcome of one question.
+
+    Batched stages (tokenize, generate, cleanup) are recorded on every
+    question of the batch, since each of them waited that long.
+    """
+
+    def __init__(self, question=None):
+        self.question = question
+        self.sql = None
+        self.outcome = None
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def finish(self, outcome=None):
+        outcome = outcome or self.outcome or 'error'
+        elapsed = time.perf_counter() - self.started
+        REQUESTS.inc(outcome=outcome)
+        REQUEST_SECONDS.observe(elapsed)
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            _log_slow({
+                'question': self.question,
+                'sql': self.sql,
+                'outcome': outcome,
+                'total_ms': round(elapsed * 1000, 2),
+                'stages_ms': {s: round(v * 1000, 2) for s, v in self.stages.items()},
+            })
+
+
+def record(traces, stage, seconds):
+    """Add a stage timing to every trace given, skipping missing ones"""
+    for trace in traces or ():
+        if trace is not None:
+            trace.add(stage, seconds)
+
+
+def _log_slow(entry):
+    line = json.dumps(entry, ensure_ascii=False)
+    if not SLOW_LOG_PATH:
+        print(f"Slow request: {line}")
+        return
+    try:
+        with open(SLOW_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+    except OSError as e:
+        print(f"Could not write slow log {SLOW_LOG_PATH}: {e}")
+
+
+async def start_server(host=None, port=None):
+    """Serve /metrics next to the polling loop; returns the runner, or None if disabled"""
+    from aiohttp import web
+
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(body=render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host or METRICS_HOST, port).start()
+    print(f"Metrics on http://{host or METRICS_HOST}:{port}/metrics")
+    return runner
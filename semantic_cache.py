@@ -0,0 +1,181 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from sql_cache import SLOTS, make_template, normalize_question, slot_counts
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of validated SQL templates for paraphrased questions.
+
+    Entries are keyed by the embedding of a question's shape (literals
+    replaced by placeholders, see normalize_question), so a paraphrase with
+    different dates or ids reuses the template with its own literals.
+    Embeddings are L2-normalized rows of one NumPy matrix; a lookup is a
+    single matrix product against the whole index, and an entry only
+    matches questions with as many literals of each kind (creator, id,
+    date, number), so a number never fills a creator or date slot. When
+    full, the least recently used entry is overwritten.
+    """
+
+    def __init__(self, max_size=None, threshold=None, path=None):
+        self.max_size = max_size or int(os.getenv('SEMANTIC_CACHE_SIZE', 4096))
+        if threshold is None:
+            threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.95))
+        self.threshold = threshold
+        self.path = path if path is not None else os.getenv('SEMANTIC_CACHE_PATH')
+        self.hits = 0
+        self.misses = 0
+        self._vectors = None
+        self._last_used = np.zeros(self.max_size)
+        self._slot_counts = np.full((self.max_size, len(SLOTS)), -1)
+        self._shapes = [None] * self.max_size
+        self._templates = [None] * self.max_size
+        self._rows = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self._rows)
+
+    @staticmethod
+    def shape(question: str) -> str:
+        return normalize_question(question)[0]
+
+    def lookup_batch(self, questions, vectors):
+        """SQL per question for those within threshold of a cached shape, else None"""
+        parsed = [normalize_question(q) for q in questions]
+        results = [None] * len(questions)
+        with self._lock:
+            if not self._rows:
+                self.misses += len(questions)
+                return results
+            queries = _normalize(np.asarray(vectors, dtype=np.float32))
+            if queries.shape[1] != self._vectors.shape[1]:
+                # Loaded from a file written with another embedding model
+                print(f"Semantic cache holds {self._vectors.shape[1]}-dimensional embeddings, "
+                      f"got {queries.shape[1]}; dropping it")
+                self._clear()
+                self._vectors = None
+                self.misses += len(questions)
+                return results
+            # (index size, batch) cosine similarities in one product
+            similarity = self._vectors @ queries.T
+            counts = np.array([slot_counts(shape) for shape, _ in parsed])
+            similarity[(self._slot_counts[:, None, :] != counts[None, :, :]).any(axis=2)] = -np.inf
+            best = similarity.argmax(axis=0)
+            now = time.monotonic()
+            for i, row in enumerate(best):
+                if similarity[row, i] < self.threshold:
+                    self.misses += 1
+                    continue
+                self.hits += 1
+                self._last_used[row] = now
+                results[i] = self._templates[row].format(*parsed[i][1])
+        return results
+
+    def put(self, question: str, vector, sql: str) -> bool:
+        shape, values = normalize_question(question)
+        template = make_template(sql, values)
+        if template is None:
+            return False
+        vector = _normalize(np.asarray(vector, dtype=np.float32)[None, :])[0]
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            elif self._vectors.shape[1] != vector.shape[0]:
+                # A different model: old embeddings are not comparable
+                self._clear()
+                self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            row = self._rows.get(shape)
+            if row is None:
+                row = len(self._rows) if len(self._rows) < self.max_size else int(self._last_used.argmin())
+                self._rows.pop(self._shapes[row], None)
+                self._rows[shape] = row
+            self._vectors[row] = vector
+            self._shapes[row] = shape
+            self._templates[row] = template
+            self._slot_counts[row] = slot_counts(shape)
+            self._last_used[row] = time.monotonic()
+        return True
+
+    def discard(self, question: str):
+        shape = self.shape(question)
+        with self._lock:
+            row = self._rows.pop(shape, None)
+            if row is None:
+                return
+            # Move the last entry into the hole to keep rows contiguous
+            last = len(self._rows)
+            if row != last:
+                moved = self._shapes[last]
+                self._rows[moved] = row
+                for array in (self._vectors, self._last_used, self._slot_counts):
+                    array[row] = array[last]
+                self._shapes[row] = moved
+                self._templates[row] = self._templates[last]
+            self._vectors[last] = 0
+            self._last_used[last] = 0
+            self._slot_counts[last] = -1
+            self._shapes[last] = self._templates[last] = None
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._rows), 'hits': self.hits, 'misses': self.misses}
+
+    def _clear(self):
+        self._rows.clear()
+        self._last_used[:] = 0
+        self._slot_counts[:] = -1
+        self._shapes = [None] * self.max_size
+        self._templates = [None] * self.max_size
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                vectors = data['vectors']
+                shapes = data['shapes'].tolist()
+                templates = data['templates'].tolist()
+                counts = data['slot_counts']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Could not load semantic cache from {self.path}: {e}")
+            return
+        # Stored oldest first, so the newest entries survive a smaller max_size
+        keep = slice(max(len(shapes) - self.max_size, 0), None)
+        vectors, shapes, templates, counts = vectors[keep], shapes[keep], templates[keep], counts[keep]
+        with self._lock:
+            self._clear()
+            self._vectors = np.zeros((self.max_size, vectors.shape[1]), dtype=np.float32)
+            self._vectors[:len(shapes)] = vectors
+            self._slot_counts[:len(shapes)] = counts
+            self._last_used[:len(shapes)] = np.arange(1, len(shapes) + 1) - len(shapes) - 1
+            for row, (shape, template) in enumerate(zip(shapes, templates)):
+                self._rows[shape] = row
+                self._shapes[row] = shape
+                self._templates[row] = template
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            rows = sorted(self._rows.values(), key=lambda row: self._last_used[row])
+            if not rows:
+                return
+            data = {
+                'vectors': self._vectors[rows],
+                'shapes': np.array([self._shapes[row] for row in rows]),
+                'templates': np.array([self._templates[row] for row in rows]),
+                'slot_counts': self._slot_counts[rows],
+            }
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, **data)
+        os.replace(tmp_path, self.path)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
@@ -0,0 +1,216 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Overloaded(Exception):
+    """A request was shed instead of queued behind model generation"""
+
+
+class SQLBatcher:
+    """Async front for SQLGenerator that runs generation off the event loop.
+
+    Concurrent requests are collected into micro-batches: the worker waits up
+    to max_wait_ms after the first request (or until max_batch_size requests
+    arrived) and then runs one padded generate call for the whole batch.
+
+    Questions the rule engine or the template cache answer never queue:
+    they are resolved on the event loop, and only the semantic cache and
+    the model run on the generation thread.
+
+    It also schedules the queue under load:
+
+    - requests are queued per chat and batches take them round robin, so
+      one chat sending many questions cannot starve the others;
+    - a request whose projected wait (its place in the round robin times
+      the recent batch duration) exceeds wait_budget_ms, or that would grow
+      the queue past max_queue or its chat's queue past max_chat_queue, is
+      shed on arrival;
+    - a request still queued deadline_ms after it arrived is shed when its
+      batch is collected.
+
+    With shed_mode 'fallback' a shed request is answered by the rule-based
+    _fallback_sql at once; with 'reject' it raises Overloaded. A zero
+    limit disables that check.
+    """
+
+    def __init__(self, generator, max_batch_size=None, max_wait_ms=None, max_queue=None,
+                 max_chat_queue=None, wait_budget_ms=None, deadline_ms=None, shed_mode=None):
+        self.generator = generator
+        self.max_batch_size = max_batch_size or int(os.getenv('SQL_BATCH_SIZE', 8))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv('SQL_BATCH_WAIT_MS', 10))
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = int(os.getenv('SQL_QUEUE_MAX', 256)) if max_queue is None else max_queue
+        if max_chat_queue is None:
+            max_chat_queue = int(os.getenv('SQL_CHAT_QUEUE_MAX', 8))
+        self.max_chat_queue = max_chat_queue
+        if wait_budget_ms is None:
+            wait_budget_ms = float(os.getenv('SQL_WAIT_BUDGET_MS', 5000))
+        self.wait_budget = wait_budget_ms / 1000
+        if deadline_ms is None:
+            deadline_ms = float(os.getenv('SQL_DEADLINE_MS', 10000))
+        self.deadline = deadline_ms / 1000
+        self.shed_mode = (shed_mode or os.getenv('SQL_SHED_MODE', 'fallback')).lower()
+        # A single thread: the model is not safe to call concurrently and
+        # batching, not thread parallelism, is what raises throughput
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sql-generate')
+        # chat id -> deque of (query, future, trace, queued time); the order is the round robin
+        self._chats = OrderedDict()
+        self._size = 0
+        self._arrived = None
+        self._worker = None
+        self._running = False
+        # Moving average of a generation batch's duration, the unit of projected wait
+        self.batch_seconds = 0.0
+        self.shed = {'wait_budget': 0, 'queue_full': 0, 'chat_queue_full': 0, 'deadline': 0}
+        self.rejected = 0
+
+    def start(self):
+        if self._worker is None:
+            self._arrived = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+
+    async def generate_sql(self, query: str, trace=None, chat_id=None) -> str:
+        return (await self.generate_candidates(query, trace, chat_id))[0][0]
+
+    async def generate_candidates(self, query: str, trace=None, chat_id=None):
+        """Ranked (sql, outcome) candidates, see SQLGenerator.generate_candidates_batch"""
+        quick = self.generator.quick_candidates(query, trace)
+        if quick is not None:
+            return quick
+        self.start()
+        reason = self._shed_reason(chat_id)
+        if reason is not None:
+            return self._shed(query, trace, reason)
+        future = asyncio.get_running_loop().create_future()
+        self._chats.setdefault(chat_id, deque()).append((query, future, trace, time.perf_counter()))
+        self._size += 1
+        self._arrived.set()
+        return await future
+
+    async def run(self, func, *args):
+        """Run other generator work on the generation thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def projected_wait(self, chat_id=None) -> float:
+        """Seconds a new request from chat_id would wait for its batch to finish"""
+        # Round robin serves every chat's first k + 1 requests before this one
+        own = len(self._chats.get(chat_id, ()))
+        ahead = sum(min(len(queue), own + 1) for queue in self._chats.values())
+        batches = math.ceil((ahead + 1) / self.max_batch_size) + self._running
+        return batches * self.batch_seconds
+
+    def stats(self):
+        return {
+            'queued': self._size,
+            'chats': len(self._chats),
+            'batch_seconds': self.batch_seconds,
+            'shed': sum(self.shed.values()),
+            'rejected': self.rejected,
+            **{f'shed_{reason}': count for reason, count in self.shed.items()},
+        }
+
+    def _shed_reason(self, chat_id):
+        if self.max_queue and self._size >= self.max_queue:
+            return 'queue_full'
+        if self.max_chat_queue and len(self._chats.get(chat_id, ())) >= self.max_chat_queue:
+            return 'chat_queue_full'
+        if self.wait_budget and self.projected_wait(chat_id) > self.wait_budget:
+            return 'wait_budget'
+        return None
+
+    def _shed(self, query, trace, reason):
+        self.shed[reason] += 1
+        if self.shed_mode == 'reject':
+            self.rejected += 1
+            if trace is not None:
+                trace.outcome = 'error'
+            raise Overloaded(reason)
+        started = time.perf_counter()
+        sql = self.generator._fallback_sql(query)
+        if trace is not None:
+            trace.add('fallback', time.perf_counter() - started)
+            trace.sql, trace.outcome = sql, 'fallback'
+        return [(sql, 'fallback')]
+
+    def _take(self, count):
+        """Up to count requests, one per chat in turn"""
+        batch = []
+        while self._chats and len(batch) < count:
+            chat_id, queue = next(iter(self._chats.items()))
+            batch.append(queue.popleft())
+            self._size -= 1
+            if queue:
+                self._chats.move_to_end(chat_id)
+            else:
+                del self._chats[chat_id]
+        return batch
+
+    async def _collect(self):
+        while not self._size:
+            self._arrived.clear()
+            await self._arrived.wait()
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while self._size < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        now = time.perf_counter()
+        batch = []
+        for query, future, trace, queued in self._take(self.max_batch_size):
+            # Drop requests whose callers already gave up
+            if future.done():
+                continue
+            if trace is not None:
+                trace.add('queue', now - queued)
+            if self.deadline and now - queued > self.deadline:
+                try:
+                    future.set_result(self._shed(query, trace, 'deadline'))
+                except Overloaded as e:
+                    future.set_exception(e)
+                continue
+            batch.append((query, future, trace, queued))
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            queries = [item[0] for item in batch]
+            traces = [item[2] for item in batch]
+            started = time.perf_counter()
+            self._running = True
+            try:
+                results = await self.run(self.generator.model_candidates_batch, queries, traces)
+            except Exception as e:
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self._running = False
+                elapsed = time.perf_counter() - started
+                self.batch_seconds = elapsed if not self.batch_seconds else 0.8 * self.batch_seconds + 0.2 * elapsed
+            for (_, future, _, _), candidates in zip(batch, results):
+                if not future.done():
+                    future.set_result(candidates)
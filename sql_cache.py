@@ -0,0 +1,147 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from intents import DATE_RE, russian_date
+
+CREATOR_RE = re.compile(r'(креатора\s+с\s+id\s+)([\w-]+)', re.IGNORECASE)
+ID_RE = re.compile(r'\b[a-f0-9-]{36}\b', re.IGNORECASE)
+NUMBER_RE = re.compile(r'\b\d+(?:[ ,]\d{3})*\b')
+
+
+# Applied in order; each pass sees the output of the previous one
+_LITERAL_PASSES = (
+    (CREATOR_RE, lambda m: m.group(1) + '<creator>', lambda m: m.group(2)),
+    (ID_RE, '<id>', lambda m: m.group(0)),
+    (DATE_RE, '<date>', lambda m: russian_date(*m.groups())),
+    (NUMBER_RE, '<num>', lambda m: re.sub(r'[ ,]', '', m.group(0))),
+)
+# Placeholders of the passes above, in the order their values are returned
+SLOTS = ('<creator>', '<id>', '<date>', '<num>')
+
+
+def normalize_question(question: str):
+    """Split a question into its shape and the literals pulled out of it.
+
+    Literals are returned in the form they take inside SQL (ISO dates, plain
+    integers), so '... 28 ноября 2025' and '... 3 декабря 2025' share a shape.
+    """
+    shape = question.strip()
+    values = []
+    for pattern, placeholder, value in _LITERAL_PASSES:
+        values.extend(value(m) for m in pattern.finditer(shape))
+        shape = pattern.sub(placeholder, shape)
+    shape = re.sub(r'\s+', ' ', shape.lower()).strip(' ?!.')
+    return shape, values
+
+
+def slot_counts(shape: str) -> tuple:
+    """Placeholders of each kind in a shape.
+
+    Values come out pass by pass, so two shapes with the same counts take
+    the same kind of literal in every position.
+    """
+    return tuple(shape.count(slot) for slot in SLOTS)
+
+
+def _literal_re(value: str):
+    return re.compile(r'(?<![\w-])' + re.escape(value) + r'(?![\w-])', re.IGNORECASE)
+
+
+def make_template(sql: str, values):
+    """Turn SQL into a str.format template over values, or None if ambiguous.
+
+    Every literal must appear in the SQL exactly once and no two literals
+    may share a value, otherwise filling in new literals could produce the
+    wrong query (a 0 threshold would also replace the 0 of COALESCE(..., 0)).
+    """
+    if len(set(values)) != len(values):
+        return None
+    spans = []
+    for i, value in enumerate(values):
+        matches = list(_literal_re(value).finditer(sql))
+        if len(matches) != 1:
+            return None
+        spans.append((matches[0].start(), matches[0].end(), i))
+    spans.sort()
+    parts, position = [], 0
+    for start, end, i in spans:
+        if start < position:
+            return None
+        parts.append(sql[position:start].replace('{', '{{').replace('}', '}}'))
+        parts.append('{%d}' % i)
+        position = end
+    parts.append(sql[position:].replace('{', '{{').replace('}', '}}'))
+    return ''.join(parts)
+
+
+class TemplateCache:
+    """Bounded LRU cache of generated SQL keyed by normalized question shape"""
+
+    def __init__(self, max_size=None, path=None):
+        self.max_size = max_size or int(os.getenv('SQL_CACHE_SIZE', 1024))
+        self.path = path if path is not None else os.getenv('SQL_CACHE_PATH')
+        self.hits = 0
+        self.misses = 0
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self.load()
+
+    def get(self, question: str):
+        shape, values = normalize_question(question)
+        with self._lock:
+            template = self._templates.get(shape)
+            if template is None:
+                self.misses += 1
+                return None
+            self._templates.move_to_end(shape)
+            self.hits += 1
+        return template.format(*values)
+
+    def put(self, question: str, sql: str) -> bool:
+        shape, values = normalize_question(question)
+        template = make_template(sql, values)
+        if template is None:
+            return False
+        with self._lock:
+            self._templates[shape] = template
+            self._templates.move_to_end(shape)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return True
+
+    def discard(self, question: str):
+        """Forget the template for this question's shape, e.g. after it failed to execute"""
+        shape, _ = normalize_question(question)
+        with self._lock:
+            self._templates.pop(shape, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._templates), 'hits': self.hits, 'misses': self.misses}
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                templates = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not load SQL cache from {self.path}: {e}")
+            return
+        with self._lock:
+            # Stored oldest first, so the newest entries survive a smaller max_size
+            for shape, template in list(templates.items())[-self.max_size:]:
+                self._templates[shape] = template
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            templates = dict(self._templates)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(templates, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
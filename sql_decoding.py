@@ -0,0 +1,148 @@
+"""Generation-time constraints that replace after-the-fact SQL repair.
+
+StatementEndCriteria ends a sequence as soon as its SELECT statement is
+closed by ';' or a newline, so no tokens are spent on text _clean_sql would
+cut off. SchemaLogitsProcessor keeps every identifier the model spells out
+after SELECT a prefix of a real table, column, SQL keyword or function,
+which rules out artifacts like TABLE_videos___ at the source.
+
+Both work from a per-token view of the vocabulary built once per tokenizer
+(TokenTable), so a decoding step costs a decode of the generated tail and a
+cached mask lookup, not a pass over the vocabulary.
+"""
+import re
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+SQL_WORDS = (
+    'select', 'from', 'where', 'and', 'or', 'not', 'in', 'is', 'null', 'as', 'on',
+    'join', 'inner', 'left', 'right', 'outer', 'group', 'by', 'order', 'having',
+    'limit', 'offset', 'asc', 'desc', 'distinct', 'between', 'like', 'ilike',
+    'case', 'when', 'then', 'else', 'end', 'union', 'all', 'exists', 'with',
+    'count', 'sum', 'avg', 'min', 'max', 'coalesce', 'date', 'date_trunc',
+    'extract', 'interval', 'timestamp', 'day', 'month', 'year', 'now',
+    'current_date', 'round', 'cast', 'true', 'false',
+)
+# Short words are let through as table aliases (v, s, t1)
+MAX_ALIAS_LENGTH = 2
+
+TABLE_RE = re.compile(r'CREATE TABLE (\w+)', re.IGNORECASE)
+COLUMN_RE = re.compile(r'^[ \t]+(\w+)\s+[A-Z]', re.MULTILINE)
+WORD_RE = re.compile(r'^\w*')
+SELECT_RE = re.compile(r'\bselect\b', re.IGNORECASE)
+# SentencePiece and byte-level BPE word-boundary and newline markers
+PIECE_MARKERS = str.maketrans({'▁': ' ', 'Ġ': ' ', 'Ċ': '\n'})
+
+
+def schema_identifiers(schema: str):
+    """Table and column names declared in CREATE TABLE statements"""
+    return {name.lower() for name in TABLE_RE.findall(schema) + COLUMN_RE.findall(schema)}
+
+
+class TokenTable:
+    """What each vocabulary entry contributes to an identifier"""
+
+    def __init__(self, tokenizer, vocab_size):
+        pieces = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        self.vocab_size = vocab_size
+        self.tokenizer = tokenizer
+        self.special = set(tokenizer.all_special_ids)
+        # SchemaLogitsProcessor masks by unfinished word; one schema per table
+        self.masks = {}
+        self.stop_ids = set()
+        self.tokens = []
+        for token_id, piece in enumerate(pieces):
+            text = (piece or '').translate(PIECE_MARKERS).lower()
+            if ';' in text or '\n' in text:
+                self.stop_ids.add(token_id)
+            # (starts a new word, leading word characters, anything after them)
+            body = text.lstrip(' ')
+            lead = WORD_RE.match(body).group(0)
+            self.tokens.append((body != text, lead, body[len(lead):]))
+
+    def decode(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+
+class StatementEndCriteria(StoppingCriteria):
+    """Stop a sequence once it has a SELECT followed by ';' or a newline"""
+
+    def __init__(self, table: TokenTable, prompt_length: int = 0):
+        self.table = table
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        last = input_ids[:, -1].tolist()
+        for row, token_id in enumerate(last):
+            if token_id not in self.table.stop_ids:
+                continue
+            text = self.table.decode(input_ids[row, self.prompt_length:])
+            match = SELECT_RE.search(text)
+            done[row] = bool(match) and (';' in text[match.end():] or '\n' in text[match.end():])
+        return done
+
+
+class SchemaLogitsProcessor(LogitsProcessor):
+    """Mask tokens that would spell an identifier outside the schema and SQL vocabulary.
+
+    Applies only after SELECT has been generated and outside quoted
+    literals; numbers, punctuation and special tokens are always allowed.
+    """
+
+    def __init__(self, table: TokenTable, identifiers, prompt_length: int = 0):
+        self.table = table
+        self.prompt_length = prompt_length
+        self.words = set(identifiers) | set(SQL_WORDS)
+        self.prefixes = {word[:i] for word in self.words for i in range(len(word) + 1)}
+
+    def _complete(self, word):
+        return not word or word.isdigit() or len(word) <= MAX_ALIAS_LENGTH or word in self.words
+
+    def _partial(self, word):
+        return word.isdigit() or len(word) <= MAX_ALIAS_LENGTH or word in self.prefixes
+
+    def _mask(self, current):
+        """Allowed tokens given the unfinished word at the end of the text"""
+        if current.isdigit():
+            current = '0'
+        mask = self.table.masks.get(current)
+        if mask is not None:
+            return mask
+        allowed = [False] * self.table.vocab_size
+        current_complete = self._complete(current)
+        for token_id, (new_word, lead, rest) in enumerate(self.table.tokens[:self.table.vocab_size]):
+            if token_id in self.table.special:
+                allowed[token_id] = True
+                continue
+            if new_word or not lead:
+                # The current word ends here
+                if not current_complete:
+                    continue
+                word = lead
+            else:
+                word = current + lead
+            # Text after the word (punctuation, a space, a quote) finishes it
+            allowed[token_id] = self._complete(word) if rest else self._partial(word)
+        mask = torch.tensor(allowed, dtype=torch.bool)
+        self.table.masks[current] = mask
+        return mask
+
+    def __call__(self, input_ids, scores):
+        for row in range(input_ids.shape[0]):
+            text = self.table.decode(input_ids[row, self.prompt_length:]).lower()
+            match = SELECT_RE.search(text)
+            if not match:
+                continue
+            tail = text[match.start():]
+            if tail.count("'") % 2:
+                continue
+            current = re.search(r'\w*$', tail).group(0)
+            mask = self._mask(current).to(scores.device)
+            if scores.shape[-1] > mask.shape[0]:
+                mask = torch.cat([mask, mask.new_zeros(scores.shape[-1] - mask.shape[0])])
+            mask = mask[:scores.shape[-1]]
+            if mask.any():
+                scores[row] = scores[row].masked_fill(~mask, float('-inf'))
+        return scores
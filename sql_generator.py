@@ -1,17 +1,94 @@
+import copy
 import os
-from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer
-import torch
+import re
+import threading
+import time
+from collections import OrderedDict
+from intents import match_intent
+from metrics import record
+from semantic_cache import SemanticCache
+from sql_cache import TemplateCache
+
+
+MAX_INPUT_LENGTH = 512
+# Reusing the schema's KV cache relies on the Cache API of transformers 5
+# (deepcopy, batch_repeat_interleave, generate() extending it in place);
+# older versions encode the whole prompt per request
+PREFIX_CACHE_MIN_TRANSFORMERS = 5
+# Embeddings of questions sent to the model, kept until their SQL is validated
+MAX_PENDING_VECTORS = 1024
 
 
 class SQLGenerator:
-    def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    def __init__(self, inference_mode=None, decoding=None, quantize=None, load=True):
+        """Settings default to the environment.
+
+        With load=False the model is loaded later by load() or
+        load_in_background(); until it is ready questions are answered by
+        the rule-based path.
+
+        SQL_INFERENCE_MODE=cpu forces CPU serving: dynamic int8 quantization
+        of the linear layers (SQL_QUANTIZE) and greedy decoding by default.
+        SQL_DECODING is one of sample (beam sampling, the original setting),
+        beam (deterministic beam search) or greedy. TORCH_NUM_THREADS sets
+        the intra-op thread count.
+        """
+        self.inference_mode = (inference_mode or os.getenv('SQL_INFERENCE_MODE', 'default')).lower()
+        cpu_mode = self.inference_mode == 'cpu'
+        self.decoding = (decoding or os.getenv('SQL_DECODING', 'greedy' if cpu_mode else 'sample')).lower()
+        if quantize is None:
+            quantize = os.getenv('SQL_QUANTIZE', 'true' if cpu_mode else 'false').lower() == 'true'
+        self.quantize = quantize
+        self.num_beams = 1 if self.decoding == 'greedy' else 2
+        # Beams returned per question as candidates; greedy decoding has only one
+        self.num_candidates = max(1, min(int(os.getenv('SQL_CANDIDATES', 2)), self.num_beams))
+        self.device = "cpu"
         self.model = None
         self.tokenizer = None
-        self._load_model()
+        self.cache = TemplateCache()
+        self.semantic_cache = None
+        if os.getenv('SEMANTIC_CACHE', 'false').lower() == 'true':
+            self.semantic_cache = SemanticCache()
+        self._pending_vectors = OrderedDict()
+        self._pending_lock = threading.Lock()
+        self.reuse_schema_prefix = os.getenv('SQL_REUSE_SCHEMA_PREFIX', 'true').lower() == 'true'
+        self._schema_ids = None
+        self._schema_cache = None
+        # Stop at the end of the statement and keep identifiers within the schema
+        self.stop_at_statement_end = os.getenv('SQL_STOP_AT_STATEMENT_END', 'true').lower() == 'true'
+        self.schema_constrained = os.getenv('SQL_SCHEMA_CONSTRAINED', 'true').lower() == 'true'
+        self._token_table = None
+        self.ready = threading.Event()
+        self._loader = None
+        if load:
+            self.load()
+
+    def load(self):
+        started = time.perf_counter()
+        try:
+            self._load_model()
+        finally:
+            self.ready.set()
+            print(f"[startup] model loading took {time.perf_counter() - started:.2f}s")
+
+    def load_in_background(self):
+        """Load the model on a daemon thread; calling it again is a no-op"""
+        if self._loader is None and not self.ready.is_set():
+            self._loader = threading.Thread(target=self.load, name="model-loader", daemon=True)
+            self._loader.start()
 
     def _load_model(self):
+        # torch and transformers take seconds to import, so they are imported
+        # here (possibly on the loader thread) rather than at module import
+        import torch
+        from transformers import AutoModelForCausalLM, AutoModelForSeq2SeqLM, AutoTokenizer
+
+        if self.inference_mode != 'cpu' and torch.cuda.is_available():
+            self.device = "cuda"
         model_path = "model"
+        num_threads = int(os.getenv('TORCH_NUM_THREADS', 0))
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
         if os.path.exists(os.path.join(model_path, "config.json")):
             try:
                 print(f"Loading model from: {model_path}")
@@ -44,6 +121,9 @@ class SQLGenerator:
                 
                 if self.tokenizer.pad_token is None:
                     self.tokenizer.pad_token = self.tokenizer.eos_token
+                # Batched causal generation needs the prompts aligned on the right
+                if not (is_encoder_decoder or model_type == "t5"):
+                    self.tokenizer.padding_side = "left"
                 
                 # Load model based on type
                 if is_encoder_decoder or model_type == "t5":
@@ -64,7 +144,18 @@ class SQLGenerator:
                         trust_remote_code=True,
                         local_files_only=True
                     )
-                print("Model loaded successfully!")
+                self.model.eval()
+                if self.quantize and self.device == "cpu":
+                    # int8 weights for nn.Linear layers, activations quantized on the fly
+                    self.model = torch.ao.quantization.quantize_dynamic(
+                        self.model, {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                    print("Applied dynamic int8 quantization")
+                print(f"Model loaded successfully! (device={self.device}, decoding={self.decoding})")
+                self._prepare_schema_prefix()
+                if self.stop_at_statement_end or self.schema_constrained:
+                    from sql_decoding import TokenTable
+                    self._token_table = TokenTable(self.tokenizer, self.model.config.vocab_size)
                 return
             except Exception as e:
                 print(f"Failed to load model: {e}")
@@ -100,122 +191,335 @@ CREATE TABLE video_snapshots (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );"""
 
-    def generate_sql(self, query):
-        if not self.model or not self.tokenizer:
-            return "SELECT COUNT(*) FROM videos"
-
+    def _build_prompt(self, query):
         # T5 prompt format
         schema = self._get_schema()
-        prompt = f"""translate to SQL: {query}
+        return f"""translate to SQL: {query}
 
 {schema}"""
 
+    def _prepare_schema_prefix(self):
+        """Tokenize the fixed schema part of the prompt once and cache what can be reused.
+
+        The T5 encoder is bidirectional and sees the schema after the question,
+        so its encoder states depend on the question and only the schema token
+        ids can be reused. Causal models get the schema first instead, which
+        lets them reuse its KV cache: per request only the question is run.
+        """
+        import torch
+        import transformers
+
+        schema = self._get_schema()
+        if self.model.config.is_encoder_decoder:
+            # Keeps the special tokens (</s>) that end the full prompt
+            self._schema_ids = self.tokenizer(f"\n\n{schema}").input_ids
+            return
+        if int(transformers.__version__.split('.')[0]) < PREFIX_CACHE_MIN_TRANSFORMERS:
+            print(f"transformers {transformers.__version__} is older than {PREFIX_CACHE_MIN_TRANSFORMERS}, "
+                  f"encoding the full prompt per request")
+            return
+        self._schema_ids = self.tokenizer(f"{schema}\n\n", add_special_tokens=False).input_ids
+        with torch.inference_mode():
+            outputs = self.model(torch.tensor([self._schema_ids], device=self.device), use_cache=True)
+        self._schema_cache = outputs.past_key_values
+
+    def _encode_batch(self, queries):
+        """Build generate() inputs for a batch of questions"""
+        import torch
+
+        if not self.reuse_schema_prefix or self._schema_ids is None:
+            inputs = self.tokenizer(
+                [self._build_prompt(query) for query in queries],
+                return_tensors="pt", padding=True, truncation=True, max_length=MAX_INPUT_LENGTH
+            ).to(self.device)
+            return {"input_ids": inputs.input_ids, "attention_mask": inputs.attention_mask}
+
+        pad_id = self.tokenizer.pad_token_id or 0
+        if self.model.config.is_encoder_decoder:
+            question_ids = self.tokenizer(
+                [f"translate to SQL: {query}" for query in queries], add_special_tokens=False
+            ).input_ids
+            rows = []
+            for ids in question_ids:
+                ids = ids + self._schema_ids
+                if len(ids) > MAX_INPUT_LENGTH:
+                    # Same as truncation=True: cut the tail but keep the final </s>
+                    ids = ids[:MAX_INPUT_LENGTH - 1] + ids[-1:]
+                rows.append(ids)
+            width = max(len(ids) for ids in rows)
+            input_ids = [ids + [pad_id] * (width - len(ids)) for ids in rows]
+            attention_mask = [[1] * len(ids) + [0] * (width - len(ids)) for ids in rows]
+            return {
+                "input_ids": torch.tensor(input_ids, device=self.device),
+                "attention_mask": torch.tensor(attention_mask, device=self.device),
+            }
+
+        budget = MAX_INPUT_LENGTH - len(self._schema_ids)
+        question_ids = [
+            ids[:budget] for ids in self.tokenizer(
+                [f"translate to SQL: {query}\n" for query in queries], add_special_tokens=False
+            ).input_ids
+        ]
+        # Questions are left-padded after the shared prefix; positions come
+        # from the attention mask, so padding in the middle is harmless
+        width = max(len(ids) for ids in question_ids)
+        prefix = self._schema_ids
+        input_ids = [prefix + [pad_id] * (width - len(ids)) + ids for ids in question_ids]
+        attention_mask = [[1] * len(prefix) + [0] * (width - len(ids)) + [1] * len(ids) for ids in question_ids]
+        # generate() extends the cache in place and does not expand it for beams
+        cache = copy.deepcopy(self._schema_cache)
+        cache.batch_repeat_interleave(len(queries) * self.num_beams)
+        return {
+            "input_ids": torch.tensor(input_ids, device=self.device),
+            "attention_mask": torch.tensor(attention_mask, device=self.device),
+            "past_key_values": cache,
+        }
+
+    def generate_sql(self, query, trace=None):
+        return self.generate_sql_batch([query], [trace])[0]
+
+    def generate_sql_batch(self, queries, traces=None):
+        """The best SQL per question, see generate_candidates_batch"""
+        return [candidates[0][0] for candidates in self.generate_candidates_batch(queries, traces)]
+
+    def generate_candidates_batch(self, queries, traces=None):
+        """Generate SQL for several questions with a single padded generate call.
+
+        Questions matched confidently by the rule engine, whose shape is
+        already in the template cache, or that paraphrase a question in the
+        semantic cache skip the model. traces, if given, is a list of
+        metrics.Trace (or None) parallel to queries.
+
+        Returns, per question, a ranked list of (sql, outcome) candidates:
+        the rule or cached SQL or the model's n-best beams, followed by the
+        rule-based fallback when it differs. The trace gets the first one.
+        """
+        traces = traces or [None] * len(queries)
+        candidates = [self.quick_candidates(query, trace) for query, trace in zip(queries, traces)]
+        pending = [i for i, ranked in enumerate(candidates) if ranked is None]
+        if pending:
+            generated = self.model_candidates_batch([queries[i] for i in pending], [traces[i] for i in pending])
+            for i, ranked in zip(pending, generated):
+                candidates[i] = ranked
+        return candidates
+
+    def quick_candidates(self, query, trace=None):
+        """Candidates from the rule engine or the template cache, or None.
+
+        Takes microseconds and never touches the model, so SQLBatcher calls
+        it on the event loop before a question is queued for generation.
+        """
+        sql, outcome = match_intent(query), 'rules'
+        if sql is None:
+            sql, outcome = self.cache.get(query), 'cache'
+        if sql is None:
+            return None
+        return self._rank(query, trace, [sql], outcome)
+
+    def model_candidates_batch(self, queries, traces=None):
+        """Candidates from the semantic cache or the model, for questions quick_candidates missed"""
+        traces = traces or [None] * len(queries)
+        results, outcomes = [None] * len(queries), [None] * len(queries)
+        pending = list(range(len(queries)))
+        if pending and self.semantic_cache is not None and self.ready.is_set() and self.model:
+            pending = self._lookup_semantic(queries, pending, traces, results, outcomes)
+        if pending and self.ready.is_set() and self.model and self.tokenizer:
+            generated = self._generate_candidates([queries[i] for i in pending], [traces[i] for i in pending])
+            for i, sqls in zip(pending, generated):
+                if sqls:
+                    results[i], outcomes[i] = sqls, 'model'
+        # Model results are the list of beams, everything else a single SQL
+        return [
+            self._rank(query, trace, sql if outcome == 'model' else [sql] if sql is not None else [], outcome)
+            for query, trace, sql, outcome in zip(queries, traces, results, outcomes)
+        ]
+
+    def _rank(self, query, trace, sqls, outcome):
+        """sqls as (sql, outcome) candidates, then the fallback when it differs"""
+        started = time.perf_counter()
+        fallback = self._fallback_sql(query)
+        ranked = [(candidate, outcome) for candidate in sqls]
+        if fallback not in sqls:
+            ranked.append((fallback, 'fallback'))
+        if ranked[0][1] == 'fallback':
+            record([trace], 'fallback', time.perf_counter() - started)
+        if trace is not None:
+            trace.sql, trace.outcome = ranked[0]
+        return ranked
+
+    def _lookup_semantic(self, queries, pending, traces, results, outcomes):
+        """Fill results from the semantic cache; returns the indexes still pending"""
+        started = time.perf_counter()
+        shapes = [SemanticCache.shape(queries[i]) for i in pending]
         try:
-            inputs = self.tokenizer(prompt, return_tensors="pt", truncation=True, max_length=512).to(self.device)
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    inputs.input_ids,
-                    max_new_tokens=128,
-                    temperature=0.3,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.pad_token_id or 0,
-                    eos_token_id=self.tokenizer.eos_token_id or 1,
-                    repetition_penalty=1.2,
-                    num_beams=2
+            vectors = self.embed(shapes)
+        except Exception as e:
+            print(f"Embedding error: {e}")
+            return pending
+        record([traces[i] for i in pending], 'embed', time.perf_counter() - started)
+
+        found = self.semantic_cache.lookup_batch([queries[i] for i in pending], vectors)
+        still_pending = []
+        with self._pending_lock:
+            for i, shape, vector, sql in zip(pending, shapes, vectors, found):
+                if sql is not None:
+                    results[i], outcomes[i] = sql, 'semantic'
+                    continue
+                still_pending.append(i)
+                self._pending_vectors[shape] = vector
+                self._pending_vectors.move_to_end(shape)
+            while len(self._pending_vectors) > MAX_PENDING_VECTORS:
+                self._pending_vectors.popitem(last=False)
+        return still_pending
+
+    def embed(self, texts):
+        """Mean-pooled last hidden states of the loaded model, one row per text"""
+        import torch
+
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True,
+                                truncation=True, max_length=MAX_INPUT_LENGTH).to(self.device)
+        with torch.inference_mode():
+            if self.model.config.is_encoder_decoder:
+                hidden = self.model.get_encoder()(
+                    input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"]
+                ).last_hidden_state
+            else:
+                hidden = self.model(**inputs, output_hidden_states=True).hidden_states[-1]
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return pooled.float().cpu().numpy()
+
+    def remember(self, question, sql):
+        """Add model SQL that executed successfully to the template and semantic caches"""
+        self.cache.put(question, sql)
+        if self.semantic_cache is None:
+            return False
+        with self._pending_lock:
+            vector = self._pending_vectors.pop(SemanticCache.shape(question), None)
+        if vector is None:
+            return False
+        return self.semantic_cache.put(question, vector, sql)
+
+    def discard(self, question):
+        """Forget cached SQL for this question's shape, e.g. after it failed to execute"""
+        self.cache.discard(question)
+        if self.semantic_cache is not None:
+            self.semantic_cache.discard(question)
+
+    def save_caches(self):
+        self.cache.save()
+        if self.semantic_cache is not None:
+            self.semantic_cache.save()
+
+    def _generation_kwargs(self, prompt_length=0):
+        """prompt_length: leading tokens of each output that are input, not generated"""
+        kwargs = {
+            "max_new_tokens": 128,
+            "pad_token_id": self.tokenizer.pad_token_id or 0,
+            "eos_token_id": self.tokenizer.eos_token_id or 1,
+            "repetition_penalty": 1.2,
+            "num_beams": self.num_beams,
+            "num_return_sequences": self.num_candidates,
+        }
+        if self.decoding == "sample":
+            kwargs.update(do_sample=True, temperature=0.3)
+        else:
+            kwargs["do_sample"] = False
+        if self._token_table is not None:
+            from transformers import LogitsProcessorList, StoppingCriteriaList
+            from sql_decoding import SchemaLogitsProcessor, StatementEndCriteria, schema_identifiers
+
+            if self.stop_at_statement_end:
+                kwargs["stopping_criteria"] = StoppingCriteriaList(
+                    [StatementEndCriteria(self._token_table, prompt_length)]
                 )
-                # For T5, decode only the generated part
-                sql = self.tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
-                
-                # Clean SQL
-                for prefix in ["```sql", "```", "SQL query:", "SQL:"]:
-                    if prefix in sql:
-                        sql = sql.split(prefix)[-1].strip()
-                
-                if sql.endswith("```"):
-                    sql = sql[:-3].strip()
-                
-                # Extract SQL if present
-                if "SELECT" in sql:
-                    sql = sql[sql.find("SELECT"):]
-                    if ";" in sql:
-                        sql = sql[:sql.index(";")].strip()
-                    elif "\n" in sql:
-                        sql = sql[:sql.index("\n")].strip()
-                
-                # Fix wrong table/column names from T5
-                import re
-                # Remove TABLE_ prefix and fix underscores
-                sql = re.sub(r'(?i)TABLE_video_snapshots[_]*', 'video_snapshots', sql)
-                sql = re.sub(r'(?i)TABLE_videos[_]*', 'videos', sql)
-                sql = re.sub(r'table_video_snapshots[_]*', 'video_snapshots', sql, flags=re.IGNORECASE)
-                sql = re.sub(r'table_videos[_]*', 'videos', sql, flags=re.IGNORECASE)
-                # Remove long underscore sequences
-                sql = re.sub(r'video_snapshots[_]{3,}', 'video_snapshots', sql)
-                sql = re.sub(r'videos[_]{3,}', 'videos', sql)
-                # Remove any remaining long underscore sequences anywhere
-                sql = re.sub(r'[_]{10,}', '', sql)
-                
-                # If SQL is empty or invalid, use fallback
-                if not sql or not sql.upper().startswith("SELECT"):
-                    return self._fallback_sql(query)
-                
-                # Check if SQL is too short (just "SELECT table_name")
-                sql_upper = sql.upper().strip()
-                if sql_upper in ["SELECT VIDEO_SNAPSHOTS", "SELECT VIDEOS", 
-                                 "SELECT VIDEO_SNAPSHOTS", "SELECT VIDEOS"]:
-                    return self._fallback_sql(query)
-                
-                # Validate table names exist and SQL is complete
-                if ("video_snapshots" in sql.lower() or "videos" in sql.lower()) and len(sql) > 20:
-                    return sql
-                else:
-                    return self._fallback_sql(query)
+            if self.schema_constrained:
+                identifiers = schema_identifiers(self._get_schema())
+                kwargs["logits_processor"] = LogitsProcessorList(
+                    [SchemaLogitsProcessor(self._token_table, identifiers, prompt_length)]
+                )
+        return kwargs
+
+    def _generate_with_model(self, queries, traces=None):
+        """Run the model on a batch; cleaned SQL per question, None where unusable"""
+        return [sqls[0] if sqls else None for sqls in self._generate_candidates(queries, traces)]
+
+    def _generate_candidates(self, queries, traces=None):
+        """Run the model on a batch; distinct usable SQL per question, best beam first"""
+        import torch
+
+        try:
+            started = time.perf_counter()
+            inputs = self._encode_batch(queries)
+            encoded = time.perf_counter()
+            record(traces, 'tokenize', encoded - started)
+            prompt_length = 0 if self.model.config.is_encoder_decoder else inputs["input_ids"].shape[1]
+            with torch.inference_mode():
+                outputs = self.model.generate(**inputs, **self._generation_kwargs(prompt_length))
+            # Causal LMs echo the prompt; decode only the generated part
+            outputs = outputs[:, prompt_length:]
+            decoded = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            record(traces, 'generate', time.perf_counter() - encoded)
         except Exception as e:
             print(f"LLM error: {e}")
-            return self._fallback_sql(query)
-    
+            return [[] for _ in queries]
+        started = time.perf_counter()
+        # generate returns num_candidates sequences per question, grouped and ranked
+        candidates = []
+        for i in range(len(queries)):
+            sqls = []
+            for raw in decoded[i * self.num_candidates:(i + 1) * self.num_candidates]:
+                sql = self._clean_sql(raw.strip())
+                if sql is not None and sql not in sqls:
+                    sqls.append(sql)
+            candidates.append(sqls)
+        record(traces, 'cleanup', time.perf_counter() - started)
+        return candidates
+
+    def _clean_sql(self, sql):
+        """Strip formatting and model artifacts; None if no usable SQL is left"""
+        for prefix in ["```sql", "```", "SQL query:", "SQL:"]:
+            if prefix in sql:
+                sql = sql.split(prefix)[-1].strip()
+
+        if sql.endswith("```"):
+            sql = sql[:-3].strip()
+
+        # Extract SQL if present
+        if "SELECT" in sql:
+            sql = sql[sql.find("SELECT"):]
+            if ";" in sql:
+                sql = sql[:sql.index(";")].strip()
+            elif "\n" in sql:
+                sql = sql[:sql.index("\n")].strip()
+
+        # Fix wrong table/column names from T5
+        # Remove TABLE_ prefix and fix underscores
+        sql = re.sub(r'(?i)TABLE_video_snapshots[_]*', 'video_snapshots', sql)
+        sql = re.sub(r'(?i)TABLE_videos[_]*', 'videos', sql)
+        sql = re.sub(r'table_video_snapshots[_]*', 'video_snapshots', sql, flags=re.IGNORECASE)
+        sql = re.sub(r'table_videos[_]*', 'videos', sql, flags=re.IGNORECASE)
+        # Remove long underscore sequences
+        sql = re.sub(r'video_snapshots[_]{3,}', 'video_snapshots', sql)
+        sql = re.sub(r'videos[_]{3,}', 'videos', sql)
+        # Remove any remaining long underscore sequences anywhere
+        sql = re.sub(r'[_]{10,}', '', sql)
+
+        # If SQL is empty or invalid, use fallback
+        if not sql or not sql.upper().startswith("SELECT"):
+            return None
+
+        # Check if SQL is too short (just "SELECT table_name")
+        sql_upper = sql.upper().strip()
+        if sql_upper in ["SELECT VIDEO_SNAPSHOTS", "SELECT VIDEOS",
+                         "SELECT VIDEO_SNAPSHOTS", "SELECT VIDEOS"]:
+            return None
+
+        # Validate table names exist and SQL is complete
+        if ("video_snapshots" in sql.lower() or "videos" in sql.lower()) and len(sql) > 20:
+            return sql
+        return None
+
     def _fallback_sql(self, query):
-        """Simple fallback SQL generation"""
-        import re
-        q = query.lower()
-        
-        if "сколько всего видео" in q:
-            return "SELECT COUNT(*) FROM videos"
-        
-        if "лайков" in q and "видео" in q:
-            match = re.search(r'([a-f0-9-]{36})', query)
-            if match:
-                return f"SELECT likes_count FROM videos WHERE id = '{match.group(1)}'"
-        
-        if ("выросли" in q or "прирост" in q) and "просмотров" in q:
-            match = re.search(r'(\d+)\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})', q)
-            if match:
-                months = {'января': '01', 'февраля': '02', 'марта': '03', 'апреля': '04',
-                         'мая': '05', 'июня': '06', 'июля': '07', 'августа': '08',
-                         'сентября': '09', 'октября': '10', 'ноября': '11', 'декабря': '12'}
-                day, month, year = match.group(1), match.group(2), match.group(3)
-                date = f"{year}-{months[month]}-{day.zfill(2)}"
-                return f"SELECT COALESCE(SUM(delta_views_count), 0) FROM video_snapshots WHERE DATE(created_at) = '{date}'"
-        
-        if "креатора" in q:
-            match = re.search(r'креатора\s+с\s+id\s+(\S+)', q)
-            if match:
-                return f"SELECT COUNT(*) FROM videos WHERE creator_id = '{match.group(1)}'"
-        
-        if "больше" in q and "просмотров" in q:
-            match = re.search(r'больше\s+(\d+[\s,]*\d*)', q)
-            if match:
-                views = match.group(1).replace(' ', '').replace(',', '')
-                return f"SELECT COUNT(*) FROM videos WHERE views_count > {views}"
-        
-        if "разных видео" in q and "просмотры" in q:
-            match = re.search(r'(\d+)\s+(января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря)\s+(\d{4})', q)
-            if match:
-                months = {'января': '01', 'февраля': '02', 'марта': '03', 'апреля': '04',
-                         'мая': '05', 'июня': '06', 'июля': '07', 'августа': '08',
-                         'сентября': '09', 'октября': '10', 'ноября': '11', 'декабря': '12'}
-                day, month, year = match.group(1), match.group(2), match.group(3)
-                date = f"{year}-{months[month]}-{day.zfill(2)}"
-                return f"SELECT COUNT(DISTINCT video_id) FROM video_snapshots WHERE DATE(created_at) = '{date}' AND delta_views_count > 0"
-        
-        return "SELECT COUNT(*) FROM videos"
+        """Best-effort rule-based SQL for when the model gives nothing usable"""
+        return match_intent(query, strict=False) or "SELECT COUNT(*) FROM videos"
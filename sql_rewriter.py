@@ -0,0 +1,101 @@
+"""Rewrite generated SQL into cheaper equivalent forms before execution.
+
+Two stages:
+1. Snapshot aggregates filtered by day are routed to the daily rollup
+   tables (daily_snapshot_stats, daily_video_stats) built by the loader.
+2. Remaining DATE(col) comparisons become half-open timestamp ranges, so
+   the planner can use the B-tree indexes on the column.
+"""
+import os
+import re
+
+USE_ROLLUPS = os.getenv('USE_ROLLUPS', 'true').lower() == 'true'
+
+_DAY = r"'(\d{4}-\d{2}-\d{2})'"
+_COLUMN = r'((?:\w+\.)?\w+)'
+# DATE(col) or col::date
+_DATE_OF = r'(?:DATE\(\s*' + _COLUMN + r'\s*\)|' + _COLUMN + r'::date)'
+
+DATE_BETWEEN_RE = re.compile(_DATE_OF + r'\s+BETWEEN\s+' + _DAY + r'\s+AND\s+' + _DAY, re.IGNORECASE)
+DATE_COMPARE_RE = re.compile(_DATE_OF + r'\s*(=|>=|<=|>|<)\s*' + _DAY, re.IGNORECASE)
+
+ROLLUP_RE = re.compile(
+    r"^SELECT\s+(?P<select>.+?)\s+FROM\s+video_snapshots\s+WHERE\s+"
+    r"(?:DATE\(\s*created_at\s*\)|created_at::date)\s*"
+    r"(?:=\s*" + _DAY + r"|BETWEEN\s+" + _DAY + r"\s+AND\s+" + _DAY + r")"
+    r"(?P<rest>(?:\s+AND\s+(?:delta_\w+\s*>=?\s*\d+"
+    r"|video_id\s+IN\s+\(\s*SELECT\s+id\s+FROM\s+videos\s+WHERE\s+creator_id\s*=\s*'[^']*'\s*\)))*)\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+SUM_DELTA_RE = re.compile(r'^(COALESCE\(\s*)?SUM\(\s*(delta_\w+_count)\s*\)(\s*,\s*0\s*\))?$', re.IGNORECASE)
+COUNT_DISTINCT_RE = re.compile(r'^COUNT\(\s*DISTINCT\s+video_id\s*\)$', re.IGNORECASE)
+COUNT_ALL_RE = re.compile(r'^COUNT\(\s*\*\s*\)$', re.IGNORECASE)
+DELTA_CONDITION_RE = re.compile(r'\bAND\s+(delta_\w+_count)(\s*>=?\s*\d+)', re.IGNORECASE)
+CREATOR_CONDITION_RE = re.compile(r'\bAND\s+video_id\s+IN\s+\(.*?\)', re.IGNORECASE | re.DOTALL)
+
+
+def _day_range(column, first, last):
+    return f"{column} >= DATE '{first}' AND {column} < DATE '{last}' + INTERVAL '1 day'"
+
+
+def make_sargable(sql: str) -> str:
+    """Turn DATE(col) = 'd' style predicates into half-open ranges on col"""
+    def between(m):
+        column = m.group(1) or m.group(2)
+        return f"({_day_range(column, m.group(3), m.group(4))})"
+
+    def compare(m):
+        column = m.group(1) or m.group(2)
+        op, day = m.group(3), m.group(4)
+        if op == '=':
+            return f"({_day_range(column, day, day)})"
+        if op == '>=':
+            return f"{column} >= DATE '{day}'"
+        if op == '>':
+            return f"{column} >= DATE '{day}' + INTERVAL '1 day'"
+        if op == '<=':
+            return f"{column} < DATE '{day}' + INTERVAL '1 day'"
+        return f"{column} < DATE '{day}'"
+
+    sql = DATE_BETWEEN_RE.sub(between, sql)
+    return DATE_COMPARE_RE.sub(compare, sql)
+
+
+def route_to_rollup(sql: str):
+    """Rewrite a per-day snapshot aggregate onto the rollup tables, or None"""
+    m = ROLLUP_RE.match(' '.join(sql.split()))
+    if not m:
+        return None
+    day, first, last = m.group(2), m.group(3), m.group(4)
+    day_filter = f"day = '{day}'" if day else f"day BETWEEN '{first}' AND '{last}'"
+    rest = m.group('rest')
+    select = m.group('select').strip()
+    creator = CREATOR_CONDITION_RE.search(rest)
+    deltas = DELTA_CONDITION_RE.findall(rest)
+    table = 'daily_video_stats' if creator else 'daily_snapshot_stats'
+    where = day_filter + (' ' + creator.group(0) if creator else '')
+
+    m = SUM_DELTA_RE.match(select)
+    if m and not deltas:
+        total = f"SUM({m.group(2)})::bigint"
+        if m.group(1):
+            total = f"COALESCE({total}, 0)"
+        return f"SELECT {total} FROM {table} WHERE {where}"
+    if COUNT_ALL_RE.match(select) and not deltas:
+        return f"SELECT COALESCE(SUM(snapshots_count), 0)::bigint FROM {table} WHERE {where}"
+    if COUNT_DISTINCT_RE.match(select) and len(deltas) <= 1:
+        # A video had a snapshot with delta > N exactly when its daily max does.
+        # Not for several conditions: the maxima may come from different snapshots
+        conditions = ''.join(f" AND max_{column}{cmp}" for column, cmp in deltas)
+        return f"SELECT COUNT(DISTINCT video_id) FROM daily_video_stats WHERE {where}{conditions}"
+    return None
+
+
+def rewrite_sql(sql: str, use_rollups: bool = None) -> str:
+    if use_rollups is None:
+        use_rollups = USE_ROLLUPS
+    if use_rollups:
+        routed = route_to_rollup(sql)
+        if routed:
+            return routed
+    return make_sargable(sql)
@@ -0,0 +1,297 @@
+"""In-process columnar copy of the videos table for hot aggregates.
+
+Most generated SQL is a simple aggregate over videos: COUNT(*), SUM of a
+metric, with filters on creator_id, metric comparisons and publish dates,
+or one metric of a video by id. VideoReplica keeps videos as NumPy columns
+with an id index, a creator_id index and each metric column sorted with
+prefix sums, and answers exactly that subset of SQL without a database
+round trip. Anything else (and any SQL while the replica is empty) returns
+None from execute() and goes to PostgreSQL.
+
+Enabled with VIDEO_REPLICA=true. The replica is rebuilt after every load or
+sync in the same process and, with VIDEO_REPLICA_REFRESH_SECONDS, on a
+timer for loads run elsewhere.
+"""
+import asyncio
+import operator
+import os
+import re
+import time
+
+import numpy as np
+
+from database import db
+
+METRIC_COLUMNS = ('views_count', 'likes_count', 'comments_count', 'reports_count')
+OPERATORS = {
+    '=': operator.eq, '!=': operator.ne, '<>': operator.ne,
+    '>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+}
+
+_METRIC = '(' + '|'.join(METRIC_COLUMNS) + ')'
+_DAY = r"'(\d{4}-\d{2}-\d{2})'"
+_PUBLISHED = r'(?:DATE\(\s*video_created_at\s*\)|video_created_at::date)'
+
+QUERY_RE = re.compile(
+    r'^SELECT\s+(?P<select>.+?)\s+FROM\s+videos(?:\s+WHERE\s+(?P<where>.+))?$',
+    re.IGNORECASE | re.DOTALL,
+)
+COUNT_RE = re.compile(r'^COUNT\(\s*\*\s*\)$', re.IGNORECASE)
+SUM_RE = re.compile(r'^(COALESCE\(\s*)?SUM\(\s*' + _METRIC + r'\s*\)(\s*,\s*0\s*\))?$', re.IGNORECASE)
+COLUMN_RE = re.compile(r'^' + _METRIC + r'$', re.IGNORECASE)
+# One WHERE condition, optionally followed by AND and the next one
+CONDITION_RES = (
+    ('id', re.compile(r"id\s*=\s*'([^']*)'", re.IGNORECASE)),
+    ('creator', re.compile(r"creator_id\s*=\s*'([^']*)'", re.IGNORECASE)),
+    ('compare', re.compile(_METRIC + r'\s*(>=|<=|<>|!=|=|>|<)\s*(\d+)', re.IGNORECASE)),
+    ('days', re.compile(_PUBLISHED + r'\s+BETWEEN\s+' + _DAY + r'\s+AND\s+' + _DAY, re.IGNORECASE)),
+    ('days', re.compile(_PUBLISHED + r'\s*=\s*' + _DAY, re.IGNORECASE)),
+)
+AND_RE = re.compile(r'\s+AND\s+', re.IGNORECASE)
+
+
+class Row(tuple):
+    """Result row that, like asyncpg.Record, is indexed by position or by name"""
+
+    def __new__(cls, names, values):
+        row = super().__new__(cls, values)
+        row._names = tuple(names)
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._names.index(key)
+        return super().__getitem__(key)
+
+    def keys(self):
+        return self._names
+
+    def values(self):
+        return tuple(self)
+
+    def items(self):
+        return zip(self._names, self)
+
+
+def parse(sql: str):
+    """(select, conditions) for SQL in the supported subset, else None.
+
+    select is ('count', None), ('sum', metric), ('coalesce', metric) or
+    ('column', metric); conditions are (kind, values) tuples.
+    """
+    m = QUERY_RE.match(' '.join(sql.strip().rstrip(';').split()))
+    if not m:
+        return None
+    select = m.group('select')
+    if COUNT_RE.match(select):
+        select = ('count', None)
+    elif SUM_RE.match(select):
+        coalesce, metric, zero = SUM_RE.match(select).groups()
+        if bool(coalesce) != bool(zero):
+            return None
+        select = ('coalesce' if coalesce else 'sum', metric.lower())
+    elif COLUMN_RE.match(select):
+        select = ('column', select.lower())
+    else:
+        return None
+
+    conditions = []
+    where = m.group('where')
+    position = 0
+    while where is not None and position < len(where):
+        for kind, pattern in CONDITION_RES:
+            condition = pattern.match(where, position)
+            if condition:
+                break
+        else:
+            return None
+        if kind == 'compare' and int(condition.group(3)) >= 2 ** 63:
+            return None
+        conditions.append((kind, condition.groups()))
+        position = condition.end()
+        if position < len(where):
+            separator = AND_RE.match(where, position)
+            if not separator:
+                return None
+            position = separator.end()
+
+    # A bare column is only answered for one video, where the row is unique
+    if select[0] == 'column' and not any(kind == 'id' for kind, _ in conditions):
+        return None
+    return select, conditions
+
+
+class _Columns:
+    """One immutable build of the replica; refresh swaps in a new one"""
+
+    def __init__(self, records):
+        self.size = len(records)
+        self.ids = {record[0]: row for row, record in enumerate(records)}
+        creators = np.array([record[1] for record in records], dtype=object)
+        names, codes = np.unique(creators, return_inverse=True)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.cumsum(np.bincount(codes, minlength=len(names)))[:-1]
+        self.creators = dict(zip(names.tolist(), np.split(order, bounds)))
+        self.published = np.array([record[2] for record in records], dtype='datetime64[us]')
+        self.metrics = {}
+        self.sorted = {}
+        for i, column in enumerate(METRIC_COLUMNS, start=3):
+            values = np.fromiter((record[i] for record in records), dtype=np.int64, count=self.size)
+            ordered = np.sort(values)
+            self.metrics[column] = values
+            # (sorted values, prefix sums) answer COUNT and SUM of one range in two searches
+            self.sorted[column] = (ordered, np.concatenate(([0], np.cumsum(ordered))))
+
+
+def _day_bounds(first, last):
+    start = np.datetime64(first, 'D').astype('datetime64[us]')
+    end = (np.datetime64(last, 'D') + 1).astype('datetime64[us]')
+    return start, end
+
+
+def _sorted_range(ordered, op, value):
+    """[lo, hi) slice of a sorted column matching column <op> value, or None"""
+    left = int(np.searchsorted(ordered, value, 'left'))
+    right = int(np.searchsorted(ordered, value, 'right'))
+    return {
+        '>': (right, len(ordered)), '>=': (left, len(ordered)),
+        '<': (0, left), '<=': (0, right), '=': (left, right),
+    }.get(op)
+
+
+class VideoReplica:
+    def __init__(self, enabled=None, refresh_seconds=None):
+        if enabled is None:
+            enabled = os.getenv('VIDEO_REPLICA', 'false').lower() == 'true'
+        self.enabled = enabled
+        if refresh_seconds is None:
+            refresh_seconds = float(os.getenv('VIDEO_REPLICA_REFRESH_SECONDS', 0))
+        self.refresh_seconds = refresh_seconds
+        self.hits = 0
+        self.misses = 0
+        self._columns = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def ready(self):
+        return self._columns is not None
+
+    def start(self):
+        """Build the replica in the background, then keep it refreshed on the timer"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Video replica refresh failed: {e}")
+            if not self.refresh_seconds:
+                return
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def refresh(self):
+        # Serialized, so the last refresh to finish has read the newest data
+        async with self._lock:
+            started = time.perf_counter()
+            async with db.acquire() as conn:
+                records = await conn.fetch(
+                    "SELECT id, creator_id, video_created_at, " + ', '.join(METRIC_COLUMNS) + " FROM videos"
+                )
+            self._columns = await asyncio.to_thread(_Columns, records)
+            print(f"Video replica: {len(records)} videos in {time.perf_counter() - started:.2f}s")
+
+    async def refresh_after_load(self):
+        """Refresh if this process serves from the replica; called by the loaders"""
+        if self.enabled and self._task is not None:
+            await self.refresh()
+
+    def covers(self, sql: str) -> bool:
+        """Whether execute() would answer sql instead of returning None"""
+        return self._columns is not None and parse(sql) is not None
+
+    def execute(self, sql: str):
+        """Rows for SQL in the supported subset, or None to run it in PostgreSQL"""
+        columns = self._columns
+        parsed = parse(sql) if columns is not None else None
+        if parsed is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        (kind, metric), conditions = parsed
+
+        bounds = None
+        if kind != 'column' and not conditions:
+            bounds = (0, columns.size)
+        elif kind != 'column' and len(conditions) == 1 and conditions[0][0] == 'compare':
+            column, op, value = conditions[0][1]
+            if kind == 'count' or metric == column.lower():
+                bounds = _sorted_range(columns.sorted[column.lower()][0], op, int(value))
+                metric = column.lower()
+        if bounds is not None:
+            lo, hi = bounds
+            if kind == 'count':
+                return [Row(('count',), (hi - lo,))]
+            total = int(columns.sorted[metric][1][hi] - columns.sorted[metric][1][lo])
+            return [Row((kind,), (total if hi > lo or kind == 'coalesce' else None,))]
+
+        rows = _select_rows(columns, conditions)
+        if kind == 'count':
+            return [Row(('count',), (len(rows),))]
+        if kind == 'column':
+            return [Row((metric,), (int(columns.metrics[metric][row]),)) for row in rows]
+        if not len(rows) and kind == 'sum':
+            return [Row(('sum',), (None,))]
+        return [Row((kind,), (int(columns.metrics[metric][rows].sum()),))]
+
+    def stats(self):
+        size = self._columns.size if self._columns is not None else 0
+        return {'size': size, 'hits': self.hits, 'misses': self.misses}
+
+
+def _select_rows(columns, conditions):
+    """Row numbers matching all conditions, narrowed by the id and creator indexes first"""
+    rows = None
+    for kind, values in conditions:
+        if kind == 'id':
+            row = columns.ids.get(values[0])
+            found = np.array([] if row is None else [row], dtype=np.int64)
+        elif kind == 'creator':
+            found = columns.creators.get(values[0], np.array([], dtype=np.int64))
+        else:
+            continue
+        rows = found if rows is None else np.intersect1d(rows, found)
+
+    mask = None
+    for kind, values in conditions:
+        if kind == 'compare':
+            column, op, value = values
+            data = columns.metrics[column.lower()]
+            matched = OPERATORS[op](data if rows is None else data[rows], int(value))
+        elif kind == 'days':
+            start, end = _day_bounds(values[0], values[-1])
+            data = columns.published if rows is None else columns.published[rows]
+            matched = (data >= start) & (data < end)
+        else:
+            continue
+        mask = matched if mask is None else mask & matched
+
+    if rows is None:
+        return np.arange(columns.size) if mask is None else np.flatnonzero(mask)
+    return rows if mask is None else rows[mask]
+
+
+# Shared instance, like database.db
+replica = VideoReplica()